@@ -29,7 +29,7 @@ from tqdm import tqdm
 
 #===============================================================================
 
-from mapmaker.properties import Properties
+from mapmaker.properties import LayerProperties, Properties
 
 #===============================================================================
 
@@ -121,5 +121,6 @@ if __name__ == '__main__':
     args.label_database = 'labels.sqlite'
     external_properties = Properties(args)
 
-    presentation = Presentation(args.powerpoint, external_properties, args)
+    presentation = Presentation(args.powerpoint, LayerProperties(external_properties), args)
     presentation.list()
+    external_properties.close()
@@ -0,0 +1,203 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2020  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""
+Time feature extraction from synthetic Powerpoint decks and compare shapes
+and features processed per second against stored baselines.
+"""
+
+#===============================================================================
+
+import argparse
+from collections import OrderedDict
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+#===============================================================================
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'mapmaker'))
+
+from drawml.geojson_extractor import GeoJsonExtractor, GeoJsonLayer
+from geometry import coordinate_precision
+
+from synthetic_deck import make_deck
+
+#===============================================================================
+
+BASELINES_FILE = os.path.join(BENCHMARKS_DIR, 'baselines.json')
+
+# Features are quantised as they are for mapmaker's default maximum zoom
+MAX_ZOOM = 10
+
+# Each benchmark is a synthetic deck; `--scale` multiplies shape and group counts
+
+BENCHMARKS = OrderedDict([
+    ('presets',  {'shapes': 400}),
+    ('freeform', {'shapes': 400, 'freeform_ratio': 1.0}),
+    ('nested',   {'shapes': 400, 'depth': 3, 'freeform_ratio': 0.5}),
+    ('regions',  {'shapes': 100, 'region_groups': 40, 'dividers': 6}),
+])
+
+#===============================================================================
+
+class GroupTimer(object):
+    """
+    Accumulate the time spent in ``GeoJsonLayer.add_geo_features_``.
+    """
+    def __init__(self):
+        self.elapsed = 0.0
+        self.__depth = 0
+
+    @contextlib.contextmanager
+    def installed(self):
+    #===================
+        add_geo_features = GeoJsonLayer.add_geo_features_
+        def timed_add_geo_features(layer, *args, **kwds):
+            # Groups are processed recursively so only time the outermost call
+            self.__depth += 1
+            start = time.perf_counter()
+            try:
+                return add_geo_features(layer, *args, **kwds)
+            finally:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    self.elapsed += time.perf_counter() - start
+        GeoJsonLayer.add_geo_features_ = timed_add_geo_features
+        try:
+            yield self
+        finally:
+            GeoJsonLayer.add_geo_features_ = add_geo_features
+
+#===============================================================================
+
+def run_benchmark(deck_file, work_dir, repeat):
+#=============================================
+    settings = argparse.Namespace(anatomical_map=None, properties=None, flatten_tolerance=None,
+                                  coordinate_precision=coordinate_precision(MAX_ZOOM),
+                                  label_database=os.path.join(work_dir, 'labels.sqlite'))
+    best = None
+    for n in range(repeat):
+        group_timer = GroupTimer()
+        # Extraction reports progress and warnings, which would swamp our results
+        with group_timer.installed(), \
+             contextlib.redirect_stdout(io.StringIO()), \
+             contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            extractor = GeoJsonExtractor(deck_file, settings)
+            layer = extractor.slide_to_layer(1, work_dir)
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best['extract-time']:
+            best = {
+                'extract-time': elapsed,
+                'group-time': group_timer.elapsed,
+                'shapes': layer.statistics['shapes'],
+                'features': layer.statistics['features'],
+            }
+    best['shapes-per-sec'] = best['shapes']/best['extract-time']
+    best['features-per-sec'] = best['features']/best['group-time'] if best['group-time'] else 0.0
+    return best
+
+#===============================================================================
+
+def compare(name, result, baseline, tolerance):
+#=============================================
+    regressions = []
+    for rate in ['shapes-per-sec', 'features-per-sec']:
+        if rate in baseline and result[rate] < (1.0 - tolerance)*baseline[rate]:
+            regressions.append('{}: {} {:.1f} is below baseline {:.1f}'.format(
+                                name, rate, result[rate], baseline[rate]))
+    return regressions
+
+def main():
+#==========
+    parser = argparse.ArgumentParser(description='Benchmark feature extraction using synthetic decks.')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                        help='runs of each benchmark, the fastest being reported (defaults to 3)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the size of each deck; baselines are only compared at scale 1')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed fractional slowdown before reporting a regression (defaults to 0.25)')
+    parser.add_argument('--save-baselines', action='store_true',
+                        help='store these results as the new baselines')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='benchmarks to run (defaults to all of {})'.format(', '.join(BENCHMARKS)))
+    args = parser.parse_args()
+
+    names = args.benchmarks if args.benchmarks else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit('Unknown benchmark: {}'.format(name))
+
+    if os.path.exists(BASELINES_FILE):
+        with open(BASELINES_FILE) as fp:
+            baselines = json.load(fp)
+    else:
+        baselines = {}
+
+    results = OrderedDict()
+    regressions = []
+    print('{:10} {:>8} {:>9} {:>10} {:>12} {:>10}'.format('benchmark', 'shapes', 'features',
+                                                         'shapes/s', 'features/s', 'baseline'))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names:
+            params = dict(BENCHMARKS[name])
+            for count in ['shapes', 'region_groups']:
+                if count in params:
+                    params[count] = max(1, int(args.scale*params[count]))
+            deck_file = os.path.join(work_dir, '{}.pptx'.format(name))
+            make_deck(deck_file, **params)
+            result = run_benchmark(deck_file, work_dir, args.repeat)
+            results[name] = result
+            baseline = baselines.get(name, {})
+            if args.scale == 1.0 and baseline:
+                regressions.extend(compare(name, result, baseline, args.tolerance))
+                ratio = '{:.2f}x'.format(result['shapes-per-sec']/baseline['shapes-per-sec'])
+            else:
+                ratio = '-'
+            print('{:10} {:8d} {:9d} {:10.1f} {:12.1f} {:>10}'.format(name,
+                  result['shapes'], result['features'],
+                  result['shapes-per-sec'], result['features-per-sec'], ratio))
+
+    if args.save_baselines:
+        if args.scale != 1.0:
+            sys.exit('Baselines can only be saved at scale 1')
+        baselines.update({name: {rate: round(result[rate], 1)
+                                    for rate in ['shapes-per-sec', 'features-per-sec']}
+                            for (name, result) in results.items()})
+        with open(BASELINES_FILE, 'w') as fp:
+            json.dump(baselines, fp, indent=4)
+            fp.write('\n')
+        print('Saved baselines to {}'.format(BASELINES_FILE))
+    elif regressions:
+        print('\n'.join(regressions))
+        sys.exit(1)
+
+#===============================================================================
+
+if __name__ == '__main__':
+    main()
+
+#===============================================================================
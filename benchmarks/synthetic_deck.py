@@ -0,0 +1,213 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2020  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""Generate synthetic Powerpoint decks for benchmarking map extraction."""
+
+#===============================================================================
+
+import math
+import random
+
+#===============================================================================
+
+from pptx import Presentation
+from pptx.enum.shapes import MSO_CONNECTOR, MSO_SHAPE
+from pptx.oxml.xmlchemy import OxmlElement
+from pptx.util import Cm, Inches
+
+#===============================================================================
+
+LAYOUT_BLANK_SLIDE = 6
+
+PRESET_SHAPES = [
+    MSO_SHAPE.RECTANGLE,
+    MSO_SHAPE.OVAL,
+    MSO_SHAPE.ROUNDED_RECTANGLE,
+    MSO_SHAPE.CHORD,
+    MSO_SHAPE.CAN,
+    MSO_SHAPE.CLOUD,
+]
+
+SHAPES_PER_GROUP = 5
+
+# Powerpoint's limits on slide size
+MIN_SLIDE_SIZE = Inches(1)
+MAX_SLIDE_SIZE = Inches(56)
+
+#===============================================================================
+
+class Cells(object):
+    """
+    Allocate non-overlapping square cells in a slide, row by row.
+    """
+    def __init__(self, count, cell_size):
+        self.__columns = max(1, math.ceil(math.sqrt(count)))
+        self.__cell_size = cell_size
+        self.__next = 0
+
+    @property
+    def extent(self):
+        rows = max(1, math.ceil(self.__next/self.__columns))
+        return (self.__columns*self.__cell_size, rows*self.__cell_size)
+
+    def next_cell(self):
+        (row, column) = divmod(self.__next, self.__columns)
+        self.__next += 1
+        return (column*self.__cell_size, row*self.__cell_size)
+
+#===============================================================================
+
+def add_point(parent, tag, *points):
+#===================================
+    element = OxmlElement(tag)
+    for (x, y) in points:
+        pt = OxmlElement('a:pt')
+        pt.set('x', str(int(x)))
+        pt.set('y', str(int(y)))
+        element.append(pt)
+    parent.append(element)
+
+def add_freeform(shapes, left, top, size, rnd):
+#=============================================
+    # Start with a square freeform and replace its outline with a
+    # closed curve made of cubic Bezier segments
+    builder = shapes.build_freeform(left, top)
+    builder.add_line_segments([(left + size, top),
+                               (left + size, top + size),
+                               (left, top + size)], close=True)
+    shape = builder.convert_to_shape()
+    path = shape.element.xpath('./p:spPr/a:custGeom/a:pathLst/a:path')[0]
+    for child in list(path):
+        path.remove(child)
+    segments = rnd.randint(4, 8)
+    centre = size/2
+    radii = [centre*rnd.uniform(0.6, 1.0) for n in range(segments)]
+    points = [(2*math.pi*n/segments, radii[n % segments]) for n in range(segments + 1)]
+    def xy(theta, radius):
+        return (centre + radius*math.cos(theta), centre + radius*math.sin(theta))
+    add_point(path, 'a:moveTo', xy(*points[0]))
+    for n in range(segments):
+        (theta0, r0) = points[n]
+        (theta1, r1) = points[n + 1]
+        d = (theta1 - theta0)/3
+        add_point(path, 'a:cubicBezTo', xy(theta0 + d, r0/math.cos(d)),
+                                        xy(theta1 - d, r1/math.cos(d)),
+                                        xy(theta1, r1))
+    path.append(OxmlElement('a:close'))
+    return shape
+
+def add_simple_shape(shapes, left, top, size, freeform_ratio, rnd, number):
+#=========================================================================
+    if rnd.random() < freeform_ratio:
+        shape = add_freeform(shapes, left, top, size, rnd)
+    else:
+        shape = shapes.add_shape(rnd.choice(PRESET_SHAPES), left, top, size, size)
+    if rnd.random() < 0.5:
+        shape.name = '.class(shape-{})'.format(number)
+    return shape
+
+def add_region_group(shapes, left, top, size, dividers, number):
+#==============================================================
+    group = shapes.add_group_shape()
+    boundary = group.shapes.add_shape(MSO_SHAPE.RECTANGLE, left, top, size, size)
+    boundary.name = '.boundary'
+    width = size/(dividers + 1)
+    for n in range(dividers + 1):
+        x = int(left + n*width)
+        if n > 0:
+            divider = group.shapes.add_connector(MSO_CONNECTOR.STRAIGHT, x, top, x, top + size)
+            divider.name = '.divider'
+        marker = group.shapes.add_shape(MSO_SHAPE.RECTANGLE, int(x + width/2) - 2, int(top + size/2) - 2, 4, 4)
+        marker.name = '.region class(region-{}-{})'.format(number, n)
+    return group
+
+#===============================================================================
+
+def make_deck(filename, shapes=100, depth=0, freeform_ratio=0.0, region_groups=0,
+              dividers=4, seed=0):
+#=========================================================================
+    """
+    Save a single slide deck with ``shapes`` simple shapes, a ``freeform_ratio``
+    share of which are curved freeforms and the rest preset shapes.
+
+    With ``depth`` > 0, shapes are placed in groups of five, nested ``depth``
+    groups deep. ``region_groups`` groups, each bounded by a rectangle and
+    divided into regions by ``dividers`` lines, are also added.
+    """
+    rnd = random.Random(seed)
+    cell_size = Cm(2)
+    cells = Cells(shapes + region_groups, cell_size)
+    shape_size = int(0.8*cell_size)
+
+    presentation = Presentation()
+    slide = presentation.slides.add_slide(presentation.slide_layouts[LAYOUT_BLANK_SLIDE])
+    slide.notes_slide.notes_text_frame.text = '.id(synthetic) description(Synthetic deck)'
+
+    number = 0
+    while number < shapes:
+        container = slide.shapes
+        groups = []
+        for level in range(depth):
+            groups.append(container.add_group_shape())
+            container = groups[-1].shapes
+        for n in range(min(shapes - number, SHAPES_PER_GROUP if depth else shapes)):
+            (left, top) = cells.next_cell()
+            add_simple_shape(container, left, top, shape_size, freeform_ratio, rnd, number)
+            number += 1
+        # Outer groups need their extents recalculated after inner ones are filled
+        for group in reversed(groups):
+            group.shapes._recalculate_extents()
+
+    for n in range(region_groups):
+        (left, top) = cells.next_cell()
+        add_region_group(slide.shapes, left, top, shape_size, dividers, n)
+
+    (width, height) = cells.extent
+    presentation.slide_width = min(max(width, MIN_SLIDE_SIZE), MAX_SLIDE_SIZE)
+    presentation.slide_height = min(max(height, MIN_SLIDE_SIZE), MAX_SLIDE_SIZE)
+    presentation.save(filename)
+
+#===============================================================================
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic Powerpoint deck.')
+    parser.add_argument('--shapes', type=int, default=100,
+                        help='number of simple shapes (defaults to 100)')
+    parser.add_argument('--depth', type=int, default=0,
+                        help='nesting depth of groups containing shapes (defaults to 0)')
+    parser.add_argument('--freeform', type=float, default=0.0, metavar='RATIO',
+                        help='share of shapes that are freeform curves (defaults to 0)')
+    parser.add_argument('--region-groups', type=int, default=0, metavar='N',
+                        help='number of groups with boundary, dividers and regions (defaults to 0)')
+    parser.add_argument('--dividers', type=int, default=4, metavar='N',
+                        help='number of dividers in each region group (defaults to 4)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for random shape placement (defaults to 0)')
+    parser.add_argument('output', metavar='POWERPOINT_FILE',
+                        help='name of the generated Powerpoint file')
+    args = parser.parse_args()
+
+    make_deck(args.output, shapes=args.shapes, depth=args.depth,
+              freeform_ratio=args.freeform, region_groups=args.region_groups,
+              dividers=args.dividers, seed=args.seed)
+
+#===============================================================================
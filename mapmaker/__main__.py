@@ -34,9 +34,13 @@ import requests
 
 #===============================================================================
 
+from buildcache import BuildCache
 from drawml import GeoJsonExtractor
 from flatmap import Flatmap
-from tilemaker import make_background_tiles_from_pdf
+from geometry import coordinate_precision
+from labels import LABEL_ENDPOINTS
+from profiler import Profiler
+from tilemaker import make_background_tiles_from_pdf, META_TILE_SIZE
 
 #===============================================================================
 
@@ -52,6 +56,9 @@ def main():
                         help="generate image tiles of map's layers (may take a while...)")
     parser.add_argument('-t', '--tile', dest='tile_slide', metavar='N', type=int, default=0,
                         help='only generate image tiles for this slide (1-origin); sets --background-tiles')
+    parser.add_argument('--meta-tile-size', metavar='N', type=int, default=META_TILE_SIZE,
+                        help='render image tiles in blocks of N by N tiles, N being a power of 2 '
+                             '(defaults to {0}; 1 renders tiles one at a time)'.format(META_TILE_SIZE))
 
     parser.add_argument('--anatomical-map',
                         help='Excel spreadsheet file for mapping shape classes to anatomical entities')
@@ -60,6 +67,12 @@ def main():
 
     parser.add_argument('--check-errors', action='store_true',
                         help="check for errors without generating a map")
+    parser.add_argument('--coordinate-precision', metavar='DECIMALS', type=int,
+                        help='round feature coordinates to this many decimal places '
+                             '(defaults to what is needed at the maximum zoom level)')
+    parser.add_argument('--flatten-tolerance', metavar='METRES', type=float,
+                        help='flatten curves so that they are no more than this distance from their outline '
+                             '(defaults to 100 points for each curve)')
     parser.add_argument('-z', '--initial-zoom', metavar='N', type=int, default=4,
                         help='initial zoom level (defaults to 4)')
     parser.add_argument('--max-zoom', dest='max_zoom', metavar='N', type=int, default=10,
@@ -68,10 +81,29 @@ def main():
                         help='minimum zoom level (defaults to 2)')
 
 
+    parser.add_argument('--offline', action='store_true',
+                        help="don't look up the labels of anatomical entities online")
+    parser.add_argument('--interlex-url', metavar='URL',
+                        help='base URL for looking up InterLex labels (defaults to {})'
+                             .format(LABEL_ENDPOINTS['interlex']))
+    parser.add_argument('--scigraph-url', metavar='URL',
+                        help='base URL for looking up other labels (defaults to {})'
+                             .format(LABEL_ENDPOINTS['scigraph']))
+
     parser.add_argument('-d', '--debug', dest='debug_xml', action='store_true',
                         help="save a slide's DrawML for debugging")
+    parser.add_argument('--profile', metavar='REPORT_FILE',
+                        help='save a JSON report of the time taken by each stage of the build')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='process all slides, ignoring layers cached by previous runs')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help='number of processes to use for extracting slides and making background tiles (defaults to 1)')
+    parser.add_argument('--optimise-tiles', action='store_true',
+                        help='analyse and vacuum tile databases once they are written (may take a while...)')
     parser.add_argument('-s', '--save-geojson', action='store_true',
                         help='Save GeoJSON files for each layer')
+    parser.add_argument('--stream-features', action='store_true',
+                        help='send features directly to tippecanoe instead of via GeoJSON files')
     parser.add_argument('-u', '--upload', metavar='USER@SERVER',
                         help='Upload generated map to server')
 
@@ -86,10 +118,10 @@ def main():
     required.add_argument('--slides', dest='powerpoint', metavar='POWERPOINT', required=True,
                         help='File or URL of Powerpoint slides')
 
-    # --force option
-
     args = parser.parse_args()
 
+    profiler = Profiler()
+
     print('Mapmaker {}'.format(__version__))
 
     if args.min_zoom < 0 or args.min_zoom > args.max_zoom:
@@ -98,6 +130,18 @@ def main():
         sys.exit('--max-zoom must be between {} and 15'.format(args.min_zoom))
     if args.initial_zoom < args.min_zoom or args.initial_zoom > args.max_zoom:
         sys.exit('--initial-zoom must be between {} and {}'.format(args.min_zoom, args.max_zoom))
+    if args.coordinate_precision is None:
+        args.coordinate_precision = coordinate_precision(args.max_zoom)
+    elif args.coordinate_precision < 0:
+        sys.exit('--coordinate-precision cannot be negative')
+    if args.flatten_tolerance is not None and args.flatten_tolerance <= 0:
+        sys.exit('--flatten-tolerance must be greater than 0')
+    if args.jobs < 1:
+        sys.exit('--jobs must be at least 1')
+    if args.meta_tile_size < 1 or args.meta_tile_size & (args.meta_tile_size - 1):
+        sys.exit('--meta-tile-size must be a power of 2')
+    if args.stream_features and args.save_geojson:
+        sys.exit('--stream-features and --save-geojson cannot be used together')
 
     map_zoom = (args.min_zoom, args.max_zoom, args.initial_zoom)
 
@@ -143,64 +187,106 @@ def main():
         os.makedirs(map_dir)
 
     args.label_database = os.path.join(args.map_base, 'labels.sqlite')
-
-    map_extractor = GeoJsonExtractor(pptx_bytes, args)
-    flatmap = Flatmap(args.map_id, map_source, ' '.join(sys.argv),
-                      map_dir, map_zoom, map_extractor.latlng_bounds())
+    args.label_endpoints = {
+        'interlex': args.interlex_url,
+        'scigraph': args.scigraph_url,
+    }
+
+    with profiler.stage('load-powerpoint'):
+        map_extractor = GeoJsonExtractor(pptx_bytes, args)
+    flatmap = None
+    try:
+        flatmap = Flatmap(args.map_id, map_source, ' '.join(sys.argv),
+                          map_dir, map_zoom, map_extractor.latlng_bounds())
 
 #*    # Labels and relationships between anatomical entities
 
 #*    args.ontology_data = OntologyData()
 #*    args.layer_mapping = LayerMapping('./layers.json', 'features')
 
-    # Process slides, saving layer information
-    print('Extracting layers...')
-    for slide_number in range(1, len(map_extractor)+1):
-        if args.tile_slide > 0 and args.tile_slide != slide_number:
-            continue
-        layer = map_extractor.slide_to_layer(slide_number, map_dir,
-                                             debug_xml=args.debug_xml)
-        for error in layer.errors:
-            print(error)
-        flatmap.add_layer(layer)
-
-    # We are finished with the Powerpoint
-    pptx_bytes.close()
+        # Tile features as they are extracted
+        if args.stream_features and not args.check_errors:
+            flatmap.stream_vector_tiles()
+
+        # Slides that haven't changed since the last run are taken from the cache
+        build_cache = None if args.force else BuildCache(map_dir, args, map_extractor.slide_size)
+
+        # Look up anatomical labels together rather than as each slide is processed
+        slide_range = args.tile_slide if args.tile_slide > 0 else None
+        if not args.offline:
+            with profiler.stage('prefetch-labels'):
+                map_extractor.prefetch_labels(slide_range, build_cache)
+
+        # Process slides, saving layer information
+        print('Extracting layers...')
+        for layer in profiler.iterate('extract-slides',
+                                      map_extractor.slides_to_layers(slide_range, map_dir,
+                                                                     debug_xml=args.debug_xml,
+                                                                     build_cache=build_cache,
+                                                                     jobs=args.jobs)):
+            for error in layer.errors:
+                print(error)
+            with profiler.stage('save-geojson'):
+                flatmap.add_layer(layer)
+            profiler.add_layer(layer)
+
+        if build_cache is not None and args.tile_slide == 0:
+            build_cache.finalise()
+
+        # We are finished with the Powerpoint
+        pptx_bytes.close()
+
+        if len(flatmap) == 0:
+            sys.exit('No map layers in Powerpoint...')
+
+        if args.check_errors:
+            # Show what the map is about
+            if flatmap.models:
+                print('Checked map for {}'.format(flatmap.models))
 
-    if len(flatmap) == 0:
-        sys.exit('No map layers in Powerpoint...')
-
-    if args.check_errors:
-        # Show what the map is about
-        if flatmap.models:
-            print('Checked map for {}'.format(flatmap.models))
-
-    else:
-        print('Running tippecanoe...')
-        flatmap.make_vector_tiles()
-
-        if args.tile_slide == 0:
-            print('Creating index and style files...')
-            flatmap.save_map_json(args.background_tiles
-                               or os.path.isfile(os.path.join(map_dir, '{}.mbtiles'.format(flatmap.layer_ids[0]))))
-
-        if args.background_tiles:
-            print('Generating background tiles (may take a while...)')
-            image_tile_files = make_background_tiles_from_pdf(flatmap.bounds, map_zoom, map_dir,
-                                                              pdf_bytes, pdf_source,
-                                                              flatmap.layer_ids, args.tile_slide)
-            flatmap.add_upload_files(image_tile_files)
-
-        # Show what the map is about
-        if flatmap.models:
-            print('Generated map for {}'.format(flatmap.models))
-
-        if args.upload:
-            print('Uploaded map...', flatmap.upload(args.map_base, args.upload))
-
-    # Tidy up
-    print('Cleaning up...')
-    flatmap.finalise(args.save_geojson)
+        else:
+            print('Running tippecanoe...')
+            with profiler.stage('tippecanoe'):
+                flatmap.make_vector_tiles(args.optimise_tiles)
+
+            if args.tile_slide == 0:
+                print('Creating index and style files...')
+                with profiler.stage('index-and-style'):
+                    flatmap.save_map_json(args.background_tiles
+                                       or os.path.isfile(os.path.join(map_dir, '{}.mbtiles'.format(flatmap.layer_ids[0]))),
+                                          args.optimise_tiles)
+
+            if args.background_tiles:
+                print('Generating background tiles (may take a while...)')
+                with profiler.stage('background-tiles'):
+                    image_tile_files = make_background_tiles_from_pdf(flatmap.bounds, map_zoom, map_dir,
+                                                                      pdf_bytes, pdf_source,
+                                                                      flatmap.layer_ids, args.tile_slide,
+                                                                      jobs=args.jobs,
+                                                                      meta_tile_size=args.meta_tile_size,
+                                                                      optimise=args.optimise_tiles)
+                flatmap.add_upload_files(image_tile_files)
+
+            # Show what the map is about
+            if flatmap.models:
+                print('Generated map for {}'.format(flatmap.models))
+
+            if args.upload:
+                with profiler.stage('upload'):
+                    print('Uploaded map...', flatmap.upload(args.map_base, args.upload))
+
+        # Tidy up
+        print('Cleaning up...')
+        flatmap.finalise(args.save_geojson)
+    finally:
+        # Don't leave a streaming `tippecanoe` to tile a partial map
+        if flatmap is not None:
+            flatmap.abort()
+        # Write any labels that are still to be saved
+        map_extractor.close()
+        # Report on what was done, even if the build stopped early
+        if args.profile:
+            profiler.save(args.profile, version=__version__, id=args.map_id, source=map_source)
 
 #===============================================================================
 
@@ -0,0 +1,162 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2020  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+import hashlib
+import os
+import pickle
+
+#===============================================================================
+
+from lxml import etree
+
+#===============================================================================
+
+from flatmap import MapLayer
+
+#===============================================================================
+
+# Increment whenever a change to mapmaker alters what is extracted from a
+# slide, so that layers cached by an earlier version are not reused.
+
+CACHE_VERSION = 1
+
+CACHE_DIRECTORY = '.build-cache'
+
+# Settings naming files whose contents affect how a slide is processed
+
+SETTINGS_FILES = ['anatomical_map', 'properties']
+
+# Other settings that affect how a slide is processed
+
+SETTINGS_VALUES = ['coordinate_precision', 'flatten_tolerance', 'label_endpoints', 'offline']
+
+#===============================================================================
+
+class CachedLayer(MapLayer):
+    """
+    The result of processing a slide, in a form that can be pickled.
+    """
+    def __init__(self, layer):
+        super().__init__(layer.layer_id)
+        self.background_for = layer.background_for
+        self.description = layer.description
+        self.models = layer.models
+        self.queryable_nodes = layer.queryable_nodes
+        self.selectable = layer.selectable
+        self.selected = layer.selected
+        self.zoom = layer.zoom
+        self.annotations.update(layer.annotations)
+        self.errors.extend(layer.errors)
+        self.map_features.extend(layer.map_features)
+        self.statistics.update(layer.statistics)
+        self.__geojson_layers = layer.geojson_layers
+        self.__resolved_pathways = layer.resolved_pathways
+        self.__slide_id = layer.slide_id
+        self.__unresolved_labels = layer.unresolved_labels
+
+    @property
+    def geojson_layers(self):
+        return self.__geojson_layers
+
+    @property
+    def resolved_pathways(self):
+        return self.__resolved_pathways
+
+    @property
+    def slide_id(self):
+        return self.__slide_id
+
+    @property
+    def unresolved_labels(self):
+        return self.__unresolved_labels
+
+#===============================================================================
+
+class BuildCache(object):
+    """
+    Processed slides, saved in the map's directory and keyed by a hash of
+    everything that determines a slide's features.
+    """
+    def __init__(self, map_dir, settings, slide_size):
+        self.__cache_dir = os.path.join(map_dir, CACHE_DIRECTORY)
+        if not os.path.exists(self.__cache_dir):
+            os.makedirs(self.__cache_dir)
+        self.__used_keys = set()
+        settings_hash = hashlib.sha256()
+        settings_hash.update('{} {}'.format(CACHE_VERSION, slide_size).encode('utf-8'))
+        for name in SETTINGS_FILES:
+            filename = getattr(settings, name, None)
+            settings_hash.update(name.encode('utf-8'))
+            if filename:
+                with open(filename, 'rb') as fp:
+                    settings_hash.update(fp.read())
+        for name in SETTINGS_VALUES:
+            settings_hash.update('{} {}'.format(name, getattr(settings, name, None)).encode('utf-8'))
+        self.__settings_digest = settings_hash.digest()
+
+    def __cache_file(self, key):
+    #===========================
+        return os.path.join(self.__cache_dir, '{}.pickle'.format(key))
+
+    def __slide_key(self, slide, slide_number):
+    #==========================================
+        slide_hash = hashlib.sha256(self.__settings_digest)
+        slide_hash.update('{} {}'.format(slide_number, slide.slide_id).encode('utf-8'))
+        slide_hash.update(etree.tostring(slide.element))
+        if slide.has_notes_slide:
+            slide_hash.update(slide.notes_slide.notes_text_frame.text.encode('utf-8'))
+        return slide_hash.hexdigest()
+
+    def has_layer(self, slide, slide_number):
+    #========================================
+        return os.path.exists(self.__cache_file(self.__slide_key(slide, slide_number)))
+
+    def get_layer(self, slide, slide_number):
+    #========================================
+        key = self.__slide_key(slide, slide_number)
+        self.__used_keys.add(key)
+        try:
+            with open(self.__cache_file(key), 'rb') as fp:
+                layer = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        # Timings are of when the slide was processed
+        for timing in ['wall-time', 'cpu-time', 'group-processing']:
+            layer.statistics.pop(timing, None)
+        layer.statistics['cached'] = True
+        return layer
+
+    def save_layer(self, slide, slide_number, layer):
+    #================================================
+        key = self.__slide_key(slide, slide_number)
+        self.__used_keys.add(key)
+        cache_file = self.__cache_file(key)
+        with open('{}.tmp'.format(cache_file), 'wb') as fp:
+            pickle.dump(CachedLayer(layer), fp, pickle.HIGHEST_PROTOCOL)
+        os.replace('{}.tmp'.format(cache_file), cache_file)
+
+    def finalise(self):
+    #==================
+        # Remove layers of slides that no longer exist or have since changed
+        for filename in os.listdir(self.__cache_dir):
+            if os.path.splitext(filename)[0] not in self.__used_keys:
+                os.remove(os.path.join(self.__cache_dir, filename))
+
+#===============================================================================
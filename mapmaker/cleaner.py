@@ -34,7 +34,7 @@ from tqdm import tqdm
 
 #===============================================================================
 
-from properties import Properties
+from properties import LayerProperties, Properties
 
 #===============================================================================
 
@@ -320,6 +320,7 @@ if __name__ == '__main__':
     args.label_database = 'labels.sqlite'
     external_properties = Properties(args)
 
-    clean_presentation(args.source_ppt, args.cleaned_ppt, external_properties)
+    clean_presentation(args.source_ppt, args.cleaned_ppt, LayerProperties(external_properties))
+    external_properties.close()
 
 #===============================================================================
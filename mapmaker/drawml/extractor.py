@@ -18,7 +18,9 @@
 #
 #===============================================================================
 
+import io
 from math import sqrt, sin, cos, pi as PI
+import multiprocessing
 import os
 
 #===============================================================================
@@ -33,9 +35,11 @@ from tqdm import tqdm
 
 #===============================================================================
 
+from buildcache import CachedLayer
 from flatmap import MapLayer
 from parser import Parser
-from properties import Properties
+from profiler import Timer
+from properties import LayerProperties, Properties
 
 #===============================================================================
 
@@ -168,7 +172,7 @@ class SlideLayer(MapLayer):
         self.__slide = slide
         self.__extractor = extractor
         self.__slide_number = slide_number
-        self.__external_properties = Properties(extractor.settings)
+        self.__external_properties = LayerProperties(extractor.properties)
         super().__init__(slide_number, self.__external_properties.pathways)
         # Find `layer-id` text boxes so we have a valid ID **before** using
         # it when setting a shape's `path_id`.
@@ -216,6 +220,10 @@ class SlideLayer(MapLayer):
     def slide_id(self):
         return self.__slide.slide_id
 
+    @property
+    def unresolved_labels(self):
+        return self.__external_properties.unresolved_labels
+
     def unique_id(self, id):
     #=======================
         return '{}#{}'.format(self.slide_id, id)
@@ -239,11 +247,7 @@ class SlideLayer(MapLayer):
     def process_finialise(self):
     #===========================
         self.__external_properties.set_feature_ids()
-
-    def save(self, filename=None):
-    #=============================
-        # Override in sub-class
-        pass
+        self.__external_properties.flush_labels()
 
     def process_group(self, group, properties, *args):
     #=================================================
@@ -266,6 +270,7 @@ class SlideLayer(MapLayer):
                 bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}')
 
         features = []
+        self.statistics['shapes'] = self.statistics.get('shapes', 0) + len(shapes)
         for shape in shapes:
             properties = self.__external_properties.get_properties(shape,
                             self.__current_group[-1],
@@ -303,14 +308,34 @@ class SlideLayer(MapLayer):
 
 #===============================================================================
 
+# Each worker process has its own extractor
+
+_slide_extractor = None
+
+def init_slide_worker_(extractor_class, pptx_source, settings):
+#=============================================================
+    global _slide_extractor
+    if isinstance(pptx_source, bytes):
+        pptx_source = io.BytesIO(pptx_source)
+    _slide_extractor = extractor_class(pptx_source, settings)
+
+def extract_slide_(args):
+#========================
+    (slide_number, map_dir, debug_xml) = args
+    return CachedLayer(_slide_extractor.process_slide_(slide_number, map_dir, debug_xml))
+
+#===============================================================================
+
 class Extractor(object):
     def __init__(self, pptx, settings, layer_class=SlideLayer):
         self.__LayerClass = layer_class
+        self.__pptx_source = pptx
         self.__pptx = Presentation(pptx)
         self.__settings = settings
         self.__slides = self.__pptx.slides
         self.__slide_size = [self.__pptx.slide_width, self.__pptx.slide_height]
         self.__layers = {}
+        self.__properties = None
 
     def __len__(self):
         return len(self.__slides)
@@ -319,10 +344,23 @@ class Extractor(object):
     def layers(self):
         return self.__layers
 
+    @property
+    def properties(self):
+        # Loaded when first needed and then shared by all slides
+        if self.__properties is None:
+            self.__properties = Properties(self.__settings)
+        return self.__properties
+
     @property
     def settings(self):
         return self.__settings
 
+    def close(self):
+    #===============
+        if self.__properties is not None:
+            self.__properties.close()
+            self.__properties = None
+
     @property
     def slide_maker(self):
         return self.__slide_maker
@@ -337,28 +375,109 @@ class Extractor(object):
     def slide(self, slide_number):
         return self.__slides[slide_number - 1]
 
-    def slide_to_layer(self, slide_number, map_dir, debug_xml=False):
+    def __add_layer(self, layer, slide_number):
+        if layer.layer_id in self.__layers:
+            raise KeyError('Duplicate layer id ({}) in slide {}'.format(layer.layer_id, slide_number))
+        self.__layers[layer.layer_id] = layer
+
+    def process_slide_(self, slide_number, map_dir, debug_xml=False, build_cache=None):
         slide = self.slide(slide_number)
         if debug_xml:
             xml = open(os.path.join(map_dir, 'layer{:02d}.xml'.format(slide_number)), 'w')
             xml.write(slide.element.xml)
             xml.close()
         if self.__LayerClass is not None:
-            layer = self.__LayerClass(self, slide, slide_number)
-            layer.process()
-            print('Slide {}, layer {}'.format(slide_number, layer.layer_id))
-
-            if layer.layer_id in self.__layers:
-                raise KeyError('Duplicate layer id ({}) in slide {}'.format(layer.layer_id, slide_number))
-            self.__layers[layer.layer_id] = layer
+            layer = None
+            if build_cache is not None:
+                layer = build_cache.get_layer(slide, slide_number)
+            if layer is not None:
+                print('Slide {}, layer {} (unchanged)'.format(slide_number, layer.layer_id))
+            else:
+                with Timer() as timer:
+                    layer = self.__LayerClass(self, slide, slide_number)
+                    layer.process()
+                layer.statistics['slide'] = slide_number
+                layer.statistics.update(timer.as_dict())
+                print('Slide {}, layer {}'.format(slide_number, layer.layer_id))
+                if build_cache is not None and not layer.unresolved_labels:
+                    build_cache.save_layer(slide, slide_number, layer)
             return layer
 
-    def slides_to_layers(self, slide_range):
+    def prefetch_labels(self, slide_range=None, build_cache=None):
+        """
+        Look up the labels of anatomical entities used in a range of slides
+        before the slides are processed. Slides in ``build_cache`` are skipped.
+        """
         if slide_range is None:
             slide_range = range(1, len(self.__slides)+1)
         elif isinstance(slide_range, int):
             slide_range = [slide_range]
-        for n in slide_range:
-            self.slide_to_layer(n)
+        def all_shapes(shapes):
+            for shape in shapes:
+                yield shape
+                if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+                    yield from all_shapes(shape.shapes)
+        if build_cache is not None:
+            slide_range = [n for n in slide_range if not build_cache.has_layer(self.slide(n), n)]
+        if slide_range:
+            self.properties.prefetch_labels(shape for n in slide_range
+                                                     for shape in all_shapes(self.slide(n).shapes))
+
+    def slide_to_layer(self, slide_number, map_dir, debug_xml=False, build_cache=None):
+        layer = self.process_slide_(slide_number, map_dir, debug_xml, build_cache)
+        if layer is not None:
+            self.__add_layer(layer, slide_number)
+        return layer
+
+    def slides_to_layers(self, slide_range, map_dir, debug_xml=False, build_cache=None, jobs=1):
+        """
+        Generate the layers of a range of slides, in slide order.
+
+        With more than one job, slides not already in ``build_cache`` are
+        processed in a pool of worker processes.
+        """
+        if slide_range is None:
+            slide_range = range(1, len(self.__slides)+1)
+        elif isinstance(slide_range, int):
+            slide_range = [slide_range]
+        if jobs <= 1:
+            for n in slide_range:
+                yield self.slide_to_layer(n, map_dir, debug_xml, build_cache)
+            return
+
+        cached_layers = {}
+        if build_cache is not None:
+            for n in slide_range:
+                layer = build_cache.get_layer(self.slide(n), n)
+                if layer is not None:
+                    cached_layers[n] = layer
+        extract_slides = [n for n in slide_range if n not in cached_layers]
+
+        pool = None
+        if extract_slides:
+            if hasattr(self.__pptx_source, 'read'):
+                self.__pptx_source.seek(0)
+                pptx_source = self.__pptx_source.read()
+            else:
+                pptx_source = self.__pptx_source
+            pool = multiprocessing.Pool(min(jobs, len(extract_slides)),
+                                        initializer=init_slide_worker_,
+                                        initargs=(self.__class__, pptx_source, self.__settings))
+            extracted_layers = pool.imap(extract_slide_, [(n, map_dir, debug_xml) for n in extract_slides])
+        try:
+            for n in slide_range:
+                if n in cached_layers:
+                    layer = cached_layers[n]
+                    print('Slide {}, layer {} (unchanged)'.format(n, layer.layer_id))
+                else:
+                    layer = next(extracted_layers)
+                    if build_cache is not None and not layer.unresolved_labels:
+                        build_cache.save_layer(self.slide(n), n, layer)
+                self.__add_layer(layer, n)
+                yield layer
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
 #===============================================================================
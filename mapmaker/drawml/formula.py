@@ -22,6 +22,7 @@
 
 #===============================================================================
 
+from functools import lru_cache
 import math
 
 import pptx.shapes.connector
@@ -128,9 +129,42 @@ class Evaluator(object):
     }
 
     @staticmethod
-    def evaluate(expr, context):
+    @lru_cache(maxsize=None)
+    def compile(expr):
+        # Formulae are parsed once, into a function of a variable evaluator
         args = expr.split()
-        return Evaluator.formulae[args[0]](context.evaluate, *args[1:])
+        formula = Evaluator.formulae[args[0]]
+        operands = args[1:]
+        return lambda evaluate: formula(evaluate, *operands)
+
+    @staticmethod
+    def evaluate(expr, context):
+        return Evaluator.compile(expr)(context.evaluate)
+
+#===============================================================================
+
+# Guides of preset shapes, by preset name
+
+_preset_guides = {}
+
+def preset_guides(name, geometry):
+#=================================
+    guides = _preset_guides.get(name)
+    if guides is None:
+        guides = guide_formulae(geometry)
+        _preset_guides[name] = guides
+    return guides
+
+def guide_formulae(geometry):
+#============================
+    guides = {}
+    if geometry.gdLst is not None:
+        for gd in geometry.gdLst:
+            guides[gd.name] = gd.fmla
+    if geometry.avLst is not None:
+        for gd in geometry.avLst:
+            guides[gd.name] = gd.fmla
+    return guides
 
 #===============================================================================
 
@@ -139,16 +173,21 @@ class Geometry(object):
         self._xfrm = shape.element.xfrm
 
         if shape.shape_type == MSO_SHAPE_TYPE.AUTO_SHAPE:
-            self._geometry = Shapes.lookup(shape.element.prstGeom.attrib['prst'])
+            preset = shape.element.prstGeom.attrib['prst']
+            self._geometry = Shapes.lookup(preset)
+            guides = preset_guides(preset, self._geometry)
             adjustments = shape.element.prstGeom.avLst
 
         elif shape.shape_type == MSO_SHAPE_TYPE.FREEFORM:
             self._geometry = shape.element.spPr.custGeom
+            guides = guide_formulae(self._geometry)
             adjustments = None
 
         elif (shape.shape_type == MSO_SHAPE_TYPE.PICTURE
            or isinstance(shape, pptx.shapes.connector.Connector)):
-            self._geometry = Shapes.lookup(shape.element.spPr.prstGeom.attrib['prst'])
+            preset = shape.element.spPr.prstGeom.attrib['prst']
+            self._geometry = Shapes.lookup(preset)
+            guides = preset_guides(preset, self._geometry)
             adjustments = None
 
         else:
@@ -158,14 +197,10 @@ class Geometry(object):
             'w': shape.width,
             'h': shape.height
         }
+        self._variables.update(guides)
 
-        if self._geometry.gdLst is not None:
-            for gd in self._geometry.gdLst:
-                self._variables[gd.name] = gd.fmla
-
-        if self._geometry.avLst is not None:
-            for gd in self._geometry.avLst:
-                self._variables[gd.name] = gd.fmla
+        # Values of variables and formulae, once evaluated
+        self._values = {}
 
         if adjustments is not None:
             for gd in adjustments:
@@ -180,6 +215,13 @@ class Geometry(object):
         return self._xfrm
 
     def evaluate(self, x):
+        try: return self._values[x]
+        except KeyError: pass
+        value = self._evaluate(x)
+        self._values[x] = value
+        return value
+
+    def _evaluate(self, x):
         try: return float(x)
         except ValueError: pass
         try: return self.evaluate(PRESET_VARIABLES[x])
@@ -18,17 +18,10 @@
 #
 #===============================================================================
 
-import json
 import math
-import os
 
 #===============================================================================
 
-# https://simoncozens.github.io/beziers.py/index.html
-from beziers.cubicbezier import CubicBezier
-from beziers.point import Point as BezierPoint
-from beziers.quadraticbezier import QuadraticBezier
-
 import numpy as np
 
 import shapely.geometry
@@ -38,10 +31,12 @@ import shapely.prepared
 #===============================================================================
 
 from parser import Parser
+from profiler import Timer
 
 from geometry import connect_dividers, extend_line, make_boundary
-from geometry import mercator_transform, mercator_transformer
-from geometry import transform_bezier_samples, transform_point
+from geometry import geojson_geometry, GeometryIndex, round_values
+from geometry import mercator_transform_all, mercator_transformer
+from geometry import PathPoints, transform_point
 from geometry import save_geometry
 
 from .arc_to_bezier import cubic_beziers_from_arc, tuple2
@@ -63,6 +58,8 @@ class GeoJsonLayer(SlideLayer):
         self.__geo_features = []
         self.__geo_pathways = []
         self.__transform = extractor.transform
+        self.__coordinate_precision = extractor.settings.coordinate_precision
+        self.__flatten_tolerance = extractor.settings.flatten_tolerance
 
     def new_feature_(self, geometry, properties, has_children=False):
     #================================================================
@@ -76,28 +73,24 @@ class GeoJsonLayer(SlideLayer):
         features = self.process_shape_list(self.slide.shapes, self.__transform, outermost=True)
         self.add_geo_features_('Slide', features, True)
         self.process_finialise()
+        self.statistics['features'] = len(self.__geo_features) + len(self.__geo_pathways)
 
-    def save_as_collection_(self, map_dir, features, layer_type):
-    #============================================================
-        # Tippecanoe doesn't need a FeatureCollection
-        # Delimit features with RS...LF   (RS = 0x1E)
-        filename = os.path.join(map_dir, '{}_{}.json'.format(self.layer_id, layer_type))
-        with open(filename, 'w') as output_file:
-            for feature in features:
-                output_file.write('\x1E{}\x0A'.format(json.dumps(feature)))
-        return filename
-
-    def save(self, map_dir):
-    #=======================
+    @property
+    def geojson_layers(self):
         return {
-            'features': self.save_as_collection_(map_dir, self.__geo_features, 'features'),
-            'pathways': self.save_as_collection_(map_dir, self.__geo_pathways, 'pathways')
+            'features': self.__geo_features,
+            'pathways': self.__geo_pathways
         }
 
     def process_group(self, group, properties, transform):
     #=====================================================
         features = self.process_shape_list(group.shapes, transform@Transform(group).matrix())
-        return self.add_geo_features_(properties.get('shape_name', ''), features)
+        with Timer() as timer:
+            grouped_feature = self.add_geo_features_(properties.get('shape_name', ''), features)
+        group_time = self.statistics.setdefault('group-processing', {'wall-time': 0.0, 'cpu-time': 0.0})
+        group_time['wall-time'] += timer.wall_time
+        group_time['cpu-time'] += timer.cpu_time
+        return grouped_feature
 
     def add_geo_features_(self, group_name, features, outermost=False):
     #==================================================================
@@ -201,14 +194,18 @@ class GeoJsonLayer(SlideLayer):
 
                 polygons = list(shapely.ops.polygonize(polygon_boundaries))
 
+                # Only regions within a polygon's bounds need to be tested
+                region_index = GeometryIndex([region.geometry for region in regions])
                 for n, polygon in enumerate(polygons):
                     prepared_polygon = shapely.prepared.prep(polygon)
                     region_id = None
                     region_properties = base_properties.copy()
-                    for region in filter(lambda p: prepared_polygon.contains(p.geometry), regions):
-                        region_properties.update(region.properties)
-                        group_features.append(Feature(region.id, polygon, region_properties))
-                        break
+                    for index in region_index.query(polygon):
+                        region = regions[index]
+                        if prepared_polygon.contains(region.geometry):
+                            region_properties.update(region.properties)
+                            group_features.append(Feature(region.id, polygon, region_properties))
+                            break
         else:
             for feature in features:
                 if feature.is_a('region'):
@@ -221,12 +218,21 @@ class GeoJsonLayer(SlideLayer):
                     interior_polygons.append(feature.geometry)
                 elif feature.geom_type == 'MultiPolygon':
                     interior_polygons.extend(list(feature.geometry))
-            interior_polygon = shapely.ops.unary_union(interior_polygons)
+            # Only remove the interior polygons that a feature actually touches
+            interior_index = GeometryIndex(interior_polygons)
+            prepared_interiors = [shapely.prepared.prep(polygon) for polygon in interior_polygons]
             for feature in group_features:
                 if (feature.annotated
                 and not feature.is_a('interior')
                 and feature.geom_type in ['Polygon', 'MultiPolygon']):
-                    feature.geometry = feature.geometry.buffer(0).difference(interior_polygon)
+                    geometry = feature.geometry
+                    if not geometry.is_valid:
+                        geometry = geometry.buffer(0)
+                    touching = [interior_polygons[n] for n in interior_index.query(geometry)
+                                    if prepared_interiors[n].intersects(geometry)]
+                    if touching:
+                        geometry = geometry.difference(shapely.ops.unary_union(touching))
+                    feature.geometry = geometry
 
         # Construct a MultiPolygon containing all of the group's polygons
         grouped_polygon_features = [ feature for feature in features if feature.has_children ]
@@ -272,6 +278,9 @@ class GeoJsonLayer(SlideLayer):
                 nerve_polygons.append(nerve_polygon_feature)
         group_features.extend(nerve_polygons)
 
+        # Project all of the group's geometries together
+        mercator_geometries = iter(mercator_transform_all([feature.geometry for feature in group_features
+                                                                if feature.geometry is not None]))
         for feature in group_features:
             if feature.geometry is not None:
                 # Initial set of properties come from ``.group``
@@ -282,18 +291,18 @@ class GeoJsonLayer(SlideLayer):
                 properties['source-layer'] = source_layer
                 geometry = feature.geometry
                 area = geometry.area
-                mercator_geometry = mercator_transform(geometry)
+                mercator_geometry = next(mercator_geometries)
                 geojson = {
                     'type': 'Feature',
                     'id': int(feature.feature_id),   # Must be numeric for tipeecanoe
                     'tippecanoe' : {
                         'layer' : source_layer
                     },
-                    'geometry': shapely.geometry.mapping(mercator_geometry),
+                    'geometry': geojson_geometry(mercator_geometry, self.__coordinate_precision),
                     'properties': {
-                        'bounds': list(mercator_geometry.bounds),
+                        'bounds': round_values(mercator_geometry.bounds, self.__coordinate_precision),
                         # The viewer requires `centroid`
-                        'centroid': list(list(mercator_geometry.centroid.coords)[0]),
+                        'centroid': round_values(mercator_geometry.centroid.coords[0], self.__coordinate_precision),
                         'area': area,
                         'length': geometry.length,
                         'layer': source_layer,
@@ -339,6 +348,8 @@ class GeoJsonLayer(SlideLayer):
             bbox = (shape.width, shape.height) if path.w is None or path.h is None else (path.w, path.h)
             T = transform@Transform(shape, bbox).matrix()
 
+            # Curves are sampled, and all points transformed, once the path is complete
+            path_points = PathPoints()
             moved = False
             first_point = None
             current_point = None
@@ -358,31 +369,30 @@ class GeoJsonLayer(SlideLayer):
                     beziers = cubic_beziers_from_arc(tuple2(wR, hR), 0, large_arc_flag, 1,
                                                      tuple2(*current_point), tuple2(*pt))
                     for bz in beziers:
-                        coordinates.extend(transform_bezier_samples(T, bz))
+                        path_points.add_bezier([(cp.x, cp.y) for cp in bz.points])
                     current_point = pt
 
                 elif c.tag == DML('close'):
                     if first_point is not None and current_point != first_point:
-                        coordinates.append(transform_point(T, first_point))
+                        path_points.add_point(first_point)
                     closed = True
                     first_point = None
                     # Close current pptx_geometry and start a new one...
 
                 elif c.tag == DML('cubicBezTo'):
-                    coords = [BezierPoint(*current_point)]
+                    coords = [current_point]
                     for p in c.getchildren():
                         pt = pptx_geometry.point(p)
-                        coords.append(BezierPoint(*pt))
+                        coords.append(pt)
                         current_point = pt
-                    bz = CubicBezier(*coords)
-                    coordinates.extend(transform_bezier_samples(T, bz))
+                    path_points.add_bezier(coords)
 
                 elif c.tag == DML('lnTo'):
                     pt = pptx_geometry.point(c.pt)
                     if moved:
-                        coordinates.append(transform_point(T, current_point))
+                        path_points.add_point(current_point)
                         moved = False
-                    coordinates.append(transform_point(T, pt))
+                    path_points.add_point(pt)
                     current_point = pt
 
                 elif c.tag == DML('moveTo'):
@@ -393,17 +403,18 @@ class GeoJsonLayer(SlideLayer):
                     moved = True
 
                 elif c.tag == DML('quadBezTo'):
-                    coords = [BezierPoint(*current_point)]
+                    coords = [current_point]
                     for p in c.getchildren():
                         pt = pptx_geometry.point(p)
-                        coords.append(BezierPoint(*pt))
+                        coords.append(pt)
                         current_point = pt
-                    bz = QuadraticBezier(*coords)
-                    coordinates.extend(transform_bezier_samples(T, bz))
+                    path_points.add_bezier(coords)
 
                 else:
                     print('Unknown path element: {}'.format(c.tag))
 
+            coordinates.extend(path_points.transformed(T, self.__flatten_tolerance).tolist())
+
 
         if closed:
             geometry = shapely.geometry.Polygon(coordinates)
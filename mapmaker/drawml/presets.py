@@ -18,7 +18,11 @@
 #
 #===============================================================================
 
-import os.path
+import hashlib
+import os
+import pickle
+
+from lxml import etree
 
 import pptx.oxml as oxml
 import pptx.oxml.ns as ns
@@ -80,15 +84,59 @@ oxml.register_element_cls("drawml:presetShape", PresetShape)
 
 #===============================================================================
 
+# Only these parts of a preset's definition are used to extract geometry
+
+DEFINITION_PARTS = ['avLst', 'gdLst', 'pathLst']
+
+PRESET_DEFINITIONS = os.path.join(os.path.dirname(__file__), 'presetShapeDefinitions.xml')
+PRESET_DEFINITIONS_CACHE = os.path.join(os.path.dirname(__file__), 'presetShapeDefinitions.pickle')
+
+#===============================================================================
+
 class Shapes(object):
     definitions_ = {}
+    sources_ = None
 
-    with open(os.path.join(os.path.dirname(__file__), 'presetShapeDefinitions.xml'), 'rb') as defs:
-        for defn in PresetShapeDefinition.new(defs.read()):
-            definitions_[defn.name] = defn
+    @staticmethod
+    def load_sources_():
+    #===================
+        # The XML of each preset's definition, cached in a pickle that is
+        # only used if the definitions file hasn't changed
+        with open(PRESET_DEFINITIONS, 'rb') as defs:
+            xml = defs.read()
+        xml_hash = hashlib.sha256(xml).hexdigest()
+        try:
+            with open(PRESET_DEFINITIONS_CACHE, 'rb') as fp:
+                cache = pickle.load(fp)
+            if cache.get('hash') == xml_hash:
+                return cache['sources']
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            pass
+        sources = {}
+        for defn in PresetShapeDefinition.new(xml):
+            for child in defn.getchildren():
+                if etree.QName(child).localname not in DEFINITION_PARTS:
+                    defn.remove(child)
+            sources[defn.name] = etree.tostring(defn)
+        # Slides may be processed in parallel, so the cache is replaced atomically
+        cache_file = '{}.{}'.format(PRESET_DEFINITIONS_CACHE, os.getpid())
+        try:
+            with open(cache_file, 'wb') as fp:
+                pickle.dump({'hash': xml_hash, 'sources': sources}, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_file, PRESET_DEFINITIONS_CACHE)
+        except OSError:
+            pass
+        return sources
 
     @staticmethod
     def lookup(name):
-        return Shapes.definitions_[name]
+        # Definitions are only parsed when first needed
+        defn = Shapes.definitions_.get(name)
+        if defn is None:
+            if Shapes.sources_ is None:
+                Shapes.sources_ = Shapes.load_sources_()
+            defn = oxml.parse_xml(Shapes.sources_[name])
+            Shapes.definitions_[name] = defn
+        return defn
 
 #===============================================================================
@@ -22,11 +22,13 @@ import datetime
 import json
 import os
 import subprocess
+import sys
 
 #===============================================================================
 
 from mbtiles import MBTiles
 from pathways import pathways_to_json
+import serialise
 from styling import Style
 from tilejson import tile_json
 
@@ -50,6 +52,7 @@ class MapLayer(object):
         self.__queryable_nodes = False
         self.__selectable = True
         self.__selected = False
+        self.__statistics = {}
         self.__zoom = None
 
     @property
@@ -76,6 +79,10 @@ class MapLayer(object):
     def errors(self):
         return self.__errors
 
+    @property
+    def geojson_layers(self):
+        return {}
+
     @property
     def layer_id(self):
         return self.__layer_id
@@ -128,6 +135,10 @@ class MapLayer(object):
     def slide_id(self):
         return None
 
+    @property
+    def statistics(self):
+        return self.__statistics
+
     @property
     def zoom(self):
         return self.__zoom
@@ -140,6 +151,21 @@ class MapLayer(object):
     #====================
         self.__errors.append(msg)
 
+    def save_as_collection_(self, map_dir, features, layer_type):
+    #============================================================
+        # Tippecanoe doesn't need a FeatureCollection
+        # Delimit features with RS...LF   (RS = 0x1E)
+        filename = os.path.join(map_dir, '{}_{}.json'.format(self.layer_id, layer_type))
+        with open(filename, 'w', encoding='utf-8') as output_file:
+            for feature in features:
+                output_file.write('\x1E{}\x0A'.format(serialise.dumps(feature)))
+        return filename
+
+    def save(self, map_dir):
+    #=======================
+        return { layer_type: self.save_as_collection_(map_dir, features, layer_type)
+                    for (layer_type, features) in self.geojson_layers.items() }
+
 #===============================================================================
 
 class Flatmap(object):
@@ -154,10 +180,13 @@ class Flatmap(object):
         self.__layer_ids = []
         self.__map_dir = map_dir
         self.__mbtiles_file = os.path.join(map_dir, 'index.mbtiles') # The vector tiles' database
+        self.__streamed_mbtiles_file = os.path.join(map_dir, 'streamed.mbtiles')
         self.__models = None
         self.__pathways = []
         self.__source = source
+        self.__tile_layer_descriptions = {}
         self.__tippe_inputs = []
+        self.__tippecanoe = None
         self.__upload_files = []
         self.__zoom = zoom
 
@@ -198,30 +227,82 @@ class Flatmap(object):
             self.__models = layer.models
         if layer.selectable:
             self.__annotations.update(layer.annotations)
-            for (layer_name, filename) in layer.save(self.__map_dir).items():
-                self.__geojson_files.append(filename)
-                self.__tippe_inputs.append({
-                    'file': filename,
-                    'layer': layer_name,
-                    'description': '{} -- {}'.format(layer.description, layer_name)
-                })
-
-    def make_vector_tiles(self):
-    #===========================
+            if self.__tippecanoe is not None:
+                # Each feature names its own tile layer
+                for (layer_name, features) in layer.geojson_layers.items():
+                    description = '{} -- {}'.format(layer.description, layer_name)
+                    for feature in features:
+                        self.__tippecanoe.stdin.write('\x1E{}\x0A'.format(serialise.dumps(feature)))
+                        tile_layer = feature.get('tippecanoe', {}).get('layer', layer_name)
+                        self.__tile_layer_descriptions[tile_layer] = description
+                    self.__tippe_inputs.append({
+                        'layer': layer_name,
+                        'description': description
+                    })
+            else:
+                for (layer_name, filename) in layer.save(self.__map_dir).items():
+                    self.__geojson_files.append(filename)
+                    self.__tippe_inputs.append({
+                        'file': filename,
+                        'layer': layer_name,
+                        'description': '{} -- {}'.format(layer.description, layer_name)
+                    })
+
+    def __tippecanoe_command(self, mbtiles_file):
+    #============================================
+        return ['tippecanoe', '--projection=EPSG:4326', '--force',
+                # No compression results in a smaller `mbtiles` file
+                # and is also required to serve tile directories
+                '--no-tile-compression',
+                '--buffer=100',
+                '--minimum-zoom={}'.format(self.__zoom[0]),
+                '--maximum-zoom={}'.format(self.__zoom[1]),
+                '--output={}'.format(mbtiles_file),
+               ]
+
+    def stream_vector_tiles(self):
+    #=============================
+        # Start `tippecanoe` so that it reads features from its standard
+        # input as layers are added, instead of from temporary files. Tiles
+        # go to a temporary database, which only replaces the map's vector
+        # tiles once all features have been tiled
+        self.__tippecanoe = subprocess.Popen(self.__tippecanoe_command(self.__streamed_mbtiles_file),
+                                             stdin=subprocess.PIPE,
+                                             encoding='utf-8')
+
+    def abort(self):
+    #===============
+        # Stop any streaming `tippecanoe` without it tiling what it has been given
+        if self.__tippecanoe is not None:
+            self.__tippecanoe.kill()
+            self.__tippecanoe.wait()
+            try:
+                self.__tippecanoe.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.__tippecanoe = None
+        if os.path.exists(self.__streamed_mbtiles_file):
+            os.remove(self.__streamed_mbtiles_file)
+
+    def make_vector_tiles(self, optimise=False):
+    #===========================================
         # Generate Mapbox vector tiles
         if len(self.__tippe_inputs) == 0:
+            self.abort()
             sys.exit('No selectable layers in Powerpoint...')
-        subprocess.run(['tippecanoe', '--projection=EPSG:4326', '--force',
-                        # No compression results in a smaller `mbtiles` file
-                        # and is also required to serve tile directories
-                        '--no-tile-compression',
-                        '--buffer=100',
-                        '--minimum-zoom={}'.format(self.__zoom[0]),
-                        '--maximum-zoom={}'.format(self.__zoom[1]),
-                        '--output={}'.format(self.__mbtiles_file),
-                        ]
-                        + list(["-L{}".format(json.dumps(input)) for input in self.__tippe_inputs])
-                       )
+        streamed = (self.__tippecanoe is not None)
+        if streamed:
+            self.__tippecanoe.stdin.close()
+            if self.__tippecanoe.wait() != 0:
+                self.__tippecanoe = None
+                self.abort()
+                sys.exit('tippecanoe failed...')
+            self.__tippecanoe = None
+            os.replace(self.__streamed_mbtiles_file, self.__mbtiles_file)
+        else:
+            subprocess.run(self.__tippecanoe_command(self.__mbtiles_file)
+                         + list(["-L{}".format(serialise.dumps(input)) for input in self.__tippe_inputs])
+                          )
 
         # `tippecanoe` uses the bounding box containing all features as the
         # map bounds, which is not the same as the extracted bounds, so update
@@ -229,12 +310,23 @@ class Flatmap(object):
         tile_db = MBTiles(self.__mbtiles_file)
         tile_db.update_metadata(center=','.join([str(x) for x in self.__centre]),
                                 bounds=','.join([str(x) for x in self.__bounds]))
-        tile_db.execute("COMMIT")
-        tile_db.close();
+        if streamed:
+            # Streamed features can't be given `-L` options, so set tile
+            # layer descriptions in the metadata instead
+            self.__set_layer_descriptions(tile_db)
+        tile_db.close(optimise=optimise);
         self.add_upload_files(['index.mbtiles'])
 
-    def save_map_json(self, has_image_layer=False):
-    #==============================================
+    def __set_layer_descriptions(self, tile_db):
+    #===========================================
+        metadata = json.loads(tile_db.metadata('json'))
+        for vector_layer in metadata.get('vector_layers', []):
+            if vector_layer['id'] in self.__tile_layer_descriptions:
+                vector_layer['description'] = self.__tile_layer_descriptions[vector_layer['id']]
+        tile_db.update_metadata(json=serialise.dumps(metadata))
+
+    def save_map_json(self, has_image_layer=False, optimise=False):
+    #===============================================================
         tile_db = MBTiles(self.__mbtiles_file)
 
         # Save path of the Powerpoint source
@@ -244,17 +336,15 @@ class Flatmap(object):
         if self.__models is not None:
             tile_db.add_metadata(describes=self.__models)
         # Save layer details in metadata
-        tile_db.add_metadata(layers=json.dumps(self.__layers))
+        tile_db.add_metadata(layers=serialise.dumps(self.__layers))
         # Save pathway details in metadata
         tile_db.add_metadata(pathways=pathways_to_json(self.__pathways))
         # Save annotations in metadata
-        tile_db.add_metadata(annotations=json.dumps(self.__annotations))
+        tile_db.add_metadata(annotations=serialise.dumps(self.__annotations))
         # Save command used to run mapmaker
         tile_db.add_metadata(created_by=self.__creator)
         # Save the maps creation time
         tile_db.add_metadata(created=datetime.datetime.utcnow().isoformat())
-        # Commit updates to the database
-        tile_db.execute("COMMIT")
 
 #*        ## TODO: set ``layer.properties`` for annotations...
 #*        ##update_RDF(args.map_base, args.map_id, source, annotations)
@@ -269,21 +359,22 @@ class Flatmap(object):
         if self.__models is not None:
             map_index['describes'] = self.__models
         # Create `index.json` for building a map in the viewer
-        with open(os.path.join(self.__map_dir, 'index.json'), 'w') as output_file:
-            json.dump(map_index, output_file)
+        with open(os.path.join(self.__map_dir, 'index.json'), 'w', encoding='utf-8') as output_file:
+            serialise.dump(map_index, output_file)
 
         # Create style file
         metadata = tile_db.metadata()
         style_dict = Style.style(self.__layer_ids, metadata, self.__zoom)
-        with open(os.path.join(self.__map_dir, 'style.json'), 'w') as output_file:
-            json.dump(style_dict, output_file)
+        with open(os.path.join(self.__map_dir, 'style.json'), 'w', encoding='utf-8') as output_file:
+            serialise.dump(style_dict, output_file)
 
         # Create TileJSON file
         json_source = tile_json(self.__id, self.__zoom, self.__bounds)
-        with open(os.path.join(self.__map_dir, 'tilejson.json'), 'w') as output_file:
-            json.dump(json_source, output_file)
+        with open(os.path.join(self.__map_dir, 'tilejson.json'), 'w', encoding='utf-8') as output_file:
+            serialise.dump(json_source, output_file)
 
-        tile_db.close();
+        # Closing the database commits our updates
+        tile_db.close(optimise=optimise);
         self.add_upload_files(['index.json', 'style.json', 'tilejson.json'])
 
     def add_upload_files(self, files):
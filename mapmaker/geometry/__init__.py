@@ -18,17 +18,25 @@
 #
 #===============================================================================
 
+from functools import lru_cache
 import math
 import warnings
 
 #===============================================================================
 
+import numpy as np
 import pyproj
 
 from shapely.geometry import LineString, Polygon
 import shapely.ops
+from shapely.strtree import STRtree
 import shapely.wkt
 
+try:
+    from shapely import transform as shapely_transform      # Shapely 2
+except ImportError:
+    shapely_transform = None
+
 #===============================================================================
 
 END_MATCH_RATIO = 0.9
@@ -55,9 +63,162 @@ mercator_transformer = pyproj.Transformer.from_proj(
 warnings.simplefilter(action='default', category=FutureWarning)
 
 
+# Web Mercator is a spherical projection and so has a closed-form inverse,
+# which we evaluate with NumPy over all of a geometry's coordinates instead
+# of calling ``pyproj``. Results agree with ``mercator_transformer`` to within
+# ``MERCATOR_TOLERANCE`` degrees.
+
+MERCATOR_RADIUS = 6378137.0
+MERCATOR_TOLERANCE = 1e-12
+
+def mercator_lnglat(x, y):
+#=========================
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return (np.degrees(x/MERCATOR_RADIUS),
+            np.degrees(np.arctan(np.sinh(y/MERCATOR_RADIUS))))
+
+def mercator_lnglat_array(coords):
+#=================================
+    return np.column_stack(mercator_lnglat(coords[:, 0], coords[:, 1]))
+
 def mercator_transform(geometry):
 #================================
-    return shapely.ops.transform(mercator_transformer.transform, geometry)
+    if shapely_transform is not None:
+        return shapely_transform(geometry, mercator_lnglat_array)
+    return shapely.ops.transform(mercator_lnglat, geometry)
+
+def mercator_transform_all(geometries):
+#======================================
+    # Shapely 2 projects all geometries in a single call
+    if shapely_transform is not None:
+        return list(shapely_transform(np.array(geometries, dtype=object), mercator_lnglat_array))
+    return [shapely.ops.transform(mercator_lnglat, geometry) for geometry in geometries]
+
+#===============================================================================
+
+# Tippecanoe resolves features at the maximum zoom level to 1/4096 of a tile,
+# so longitudes and latitudes need only enough decimal places for that, with
+# one more to keep rounding error well below it.
+
+TILE_DETAIL_BITS = 12
+
+def coordinate_precision(max_zoom):
+#==================================
+    return math.ceil(math.log10(2**(max_zoom + TILE_DETAIL_BITS)/360.0)) + 1
+
+def round_values(values, precision):
+#===================================
+    if precision is None:
+        return list(values)
+    return [round(value, precision) for value in values]
+
+def quantise_coordinates(coords, precision, min_points=1):
+#=========================================================
+    # Round coordinates and then drop any consecutive duplicates that rounding
+    # creates, provided there are enough points left to keep the geometry valid
+    if precision is None:
+        return coords
+    coords = np.round(coords, precision)
+    if len(coords) > min_points:
+        distinct = np.ones(len(coords), dtype=bool)
+        distinct[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+        if np.count_nonzero(distinct) >= min_points:
+            coords = coords[distinct]
+    return coords
+
+# Like ``shapely.geometry.mapping()`` but with coordinates as NumPy arrays,
+# which ``serialise.dumps()`` writes directly instead of via nested tuples,
+# optionally quantised to ``precision`` decimal places.
+
+def coordinate_array_(geometry, precision, min_points=1):
+#========================================================
+    return quantise_coordinates(np.asarray(geometry.coords), precision, min_points)
+
+def polygon_coordinates_(polygon, precision):
+#============================================
+    return ([coordinate_array_(polygon.exterior, precision, 4)]
+          + [coordinate_array_(interior, precision, 4) for interior in polygon.interiors])
+
+def geojson_geometry(geometry, precision=None):
+#==============================================
+    if geometry.is_empty:
+        return shapely.geometry.mapping(geometry)
+    geometry_type = geometry.geom_type
+    if geometry_type == 'Point':
+        coordinates = coordinate_array_(geometry, precision)[0]
+    elif geometry_type == 'LineString':
+        coordinates = coordinate_array_(geometry, precision, 2)
+    elif geometry_type == 'LinearRing':
+        return {'type': 'LineString', 'coordinates': coordinate_array_(geometry, precision, 4)}
+    elif geometry_type == 'Polygon':
+        coordinates = polygon_coordinates_(geometry, precision)
+    elif geometry_type == 'MultiPoint':
+        coordinates = [coordinate_array_(geo, precision)[0] for geo in geometry.geoms]
+    elif geometry_type == 'MultiLineString':
+        coordinates = [coordinate_array_(geo, precision, 2) for geo in geometry.geoms]
+    elif geometry_type == 'MultiPolygon':
+        coordinates = [polygon_coordinates_(geo, precision) for geo in geometry.geoms]
+    elif geometry_type == 'GeometryCollection':
+        return {'type': geometry_type,
+                'geometries': [geojson_geometry(geo, precision) for geo in geometry.geoms]}
+    else:
+        return shapely.geometry.mapping(geometry)
+    return {'type': geometry_type, 'coordinates': coordinates}
+
+#===============================================================================
+
+class GeometryIndex(object):
+    """
+    A spatial index of geometries, returning the positions in the original list
+    of geometries whose bounding boxes intersect that of a query geometry.
+    """
+    def __init__(self, geometries):
+        self.__geometries = list(geometries)
+        with warnings.catch_warnings():
+            # Shapely 1.8 warns that STRtree will change in Shapely 2
+            warnings.simplefilter(action='ignore', category=FutureWarning)
+            self.__tree = STRtree(self.__geometries) if len(self.__geometries) else None
+
+    def query(self, geometry):
+    #=========================
+        if self.__tree is None:
+            return []
+        if hasattr(self.__tree, 'query_items'):     # Shapely 1.8
+            return sorted(self.__tree.query_items(geometry))
+        return sorted(int(index) for index in self.__tree.query(geometry))
+
+#===============================================================================
+
+class PointGrid(object):
+    """
+    Items placed at points, binned into square cells for finding those near
+    a given point.
+    """
+    def __init__(self, cell_size):
+        self.__cell_size = cell_size
+        self.__cells = {}
+
+    def __cell(self, x, y):
+    #======================
+        return (math.floor(x/self.__cell_size), math.floor(y/self.__cell_size))
+
+    def add(self, point, item):
+    #==========================
+        self.__cells.setdefault(self.__cell(point[0], point[1]), []).append((point, item))
+
+    def near(self, point, distance):
+    #===============================
+        (x, y) = (point[0], point[1])
+        (min_i, min_j) = self.__cell(x - distance, y - distance)
+        (max_i, max_j) = self.__cell(x + distance, y + distance)
+        items = []
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                for (p, item) in self.__cells.get((i, j), []):
+                    if math.hypot(p[0] - x, p[1] - y) <= distance:
+                        items.append(item)
+        return items
 
 #===============================================================================
 
@@ -65,10 +226,95 @@ def transform_point(transform, point):
 #=====================================
     return (transform@[point[0], point[1], 1.0])[:2]
 
-def transform_bezier_samples(transform, bz):
-#===========================================
-    samples = 100
-    return [transform_point(transform, (pt.x, pt.y)) for pt in bz.sample(samples)]
+def transform_points(transform, points):
+#=======================================
+    # Transform an (N, 2) array of points with a single multiplication
+    return points@transform[:2, :2].T + transform[:2, 2]
+
+#===============================================================================
+
+BEZIER_SAMPLES = 100
+
+@lru_cache(maxsize=None)
+def bernstein_basis(degree, samples=BEZIER_SAMPLES):
+#===================================================
+    # Bernstein polynomials of ``degree`` evaluated at ``samples + 1`` evenly
+    # spaced times, as a (samples + 1, degree + 1) array
+    t = np.linspace(0.0, 1.0, samples + 1)[:, np.newaxis]
+    k = np.arange(degree + 1)
+    binomials = np.array([math.factorial(degree)/(math.factorial(i)*math.factorial(degree - i))
+                            for i in k])
+    basis = binomials*t**k*(1.0 - t)**(degree - k)
+    basis.flags.writeable = False
+    return basis
+
+def bezier_samples(control_points, samples=BEZIER_SAMPLES):
+#==========================================================
+    # Sample curves of the same degree, given as an (N, degree + 1, 2) array
+    # of control points, returning a (N, samples + 1, 2) array of points
+    control_points = np.asarray(control_points, dtype=float)
+    basis = bernstein_basis(control_points.shape[1] - 1, samples)
+    return np.einsum('sk,nkd->nsd', basis, control_points)
+
+def bezier_sample_counts(control_points, tolerance):
+#===================================================
+    # The number of evenly spaced segments needed to keep the chords of
+    # each curve within ``tolerance`` of it, using Wang's formula
+    degree = control_points.shape[1] - 1
+    if degree < 2:
+        return np.ones(len(control_points), dtype=int)
+    differences = control_points[:, 2:] - 2*control_points[:, 1:-1] + control_points[:, :-2]
+    length = np.max(np.hypot(differences[..., 0], differences[..., 1]), axis=1)
+    counts = np.ceil(np.sqrt(degree*(degree - 1)*length/(8.0*tolerance)))
+    return np.clip(counts, 1, BEZIER_SAMPLES).astype(int)
+
+#===============================================================================
+
+class PathPoints(object):
+    """
+    The points and Bezier curves of a path, in the path's coordinates, which are
+    transformed and sampled together once the path is complete.
+    """
+    def __init__(self):
+        self.__pieces = []
+        self.__points = []
+        self.__curves = {}
+
+    def add_point(self, point):
+    #==========================
+        self.__pieces.append((None, len(self.__points)))
+        self.__points.append(point)
+
+    def add_bezier(self, control_points):
+    #====================================
+        curves = self.__curves.setdefault(len(control_points) - 1, [])
+        self.__pieces.append((len(control_points) - 1, len(curves)))
+        curves.append(control_points)
+
+    def transformed(self, transform, tolerance=None):
+    #================================================
+        # Sample curves at a fixed number of points or, given a ``tolerance``,
+        # with as few points as keep the path within it, in transformed units
+        if len(self.__pieces) == 0:
+            return np.empty((0, 2))
+        points = transform_points(transform, np.array(self.__points, dtype=float).reshape(-1, 2))
+        samples = {}
+        for (degree, curves) in self.__curves.items():
+            # Bezier curves are affine invariant so we transform control points
+            control_points = transform_points(transform, np.array(curves, dtype=float))
+            if tolerance is None:
+                samples[degree] = bezier_samples(control_points)
+            else:
+                counts = bezier_sample_counts(control_points, tolerance)
+                samples[degree] = [None]*len(counts)
+                for count in np.unique(counts):
+                    indices = np.flatnonzero(counts == count)
+                    for (index, curve_samples) in zip(indices,
+                                                      bezier_samples(control_points[indices], count)):
+                        samples[degree][index] = curve_samples
+        return np.concatenate([points[index:index+1] if degree is None
+                                else samples[degree][index]
+                                    for (degree, index) in self.__pieces])
 
 #===============================================================================
 
@@ -147,15 +393,25 @@ class LineMatcher(object):
 def make_boundary(line_segments):
     lines = list(line_segments)
     line_matcher = LineMatcher(lines[0])
-    remainder = lines[1:]
+    # Segments are tried in order but only those that might extend the boundary,
+    # by crossing its last segment or having an end close to its end, are tested
+    segment_index = GeometryIndex(lines)
+    end_grid = PointGrid(ALMOST_TOUCHING)
+    for (n, line) in enumerate(lines):
+        end_grid.add(line.coords[0], n)
+        end_grid.add(line.coords[-1], n)
+    reach = ALMOST_TOUCHING*(1.0 + 1e-6)    # Allow for rounding
+    remainder = set(range(1, len(lines)))
     while len(remainder) > 0:
-        for (n, line) in enumerate(remainder):
-            if line_matcher.extend(line):
-                del remainder[n]
+        previous = line_matcher.previous
+        candidates = set(segment_index.query(previous))
+        candidates.update(end_grid.near(previous.coords[-1], reach))
+        for n in sorted(candidates & remainder):
+            if line_matcher.extend(lines[n]):
+                remainder.remove(n)
                 break
-            else:
-                if n == (len(remainder) - 1):
-                    raise ValueError("Boundary segment doesn't have a close neighbour")
+        else:
+            raise ValueError("Boundary segment doesn't have a close neighbour")
     if line_matcher.extend(lines[0]):
         coords = line_matcher.coords
         if coords[0] != coords[-1]:
@@ -184,12 +440,38 @@ def endpoint(point, line):
 
 #===============================================================================
 
+def bounds_distance(bounds1, bounds2):
+    dx = max(bounds1[0] - bounds2[2], bounds2[0] - bounds1[2], 0.0)
+    dy = max(bounds1[1] - bounds2[3], bounds2[1] - bounds1[3], 0.0)
+    return math.sqrt(dx*dx + dy*dy)
+
+def near_bounds(geometry, distance):
+    bounds = geometry.bounds
+    return shapely.geometry.box(bounds[0] - distance, bounds[1] - distance,
+                                bounds[2] + distance, bounds[3] + distance)
+
 def connect_dividers(dividers, debug):
     connectors = []
+    # Nothing is done to a pair of dividers further apart than ``ALMOST_TOUCHING``,
+    # so we skip pairs whose bounds are this far apart. Candidates come from an
+    # index of the dividers as given; dividers that have since been extended
+    # are checked directly. (A little slack allows for rounding.)
+    reach = ALMOST_TOUCHING*(1.0 + 1e-6)
+    original_dividers = list(dividers)
+    divider_index = GeometryIndex(original_dividers)
     for n in range(len(dividers) - 1):
         divider1 = dividers[n]
+        indexed_divider = None
         for m in range(n + 1, len(dividers)):
+            if indexed_divider is not divider1:
+                near_dividers = set(divider_index.query(near_bounds(divider1, reach)))
+                indexed_divider = divider1
             divider2 = dividers[m]
+            if divider2 is original_dividers[m]:
+                if m not in near_dividers:
+                    continue
+            elif bounds_distance(divider1.bounds, divider2.bounds) > reach:
+                continue
             if divider1.boundary.is_empty and divider2.boundary.is_empty:
                 nearest = shapely.ops.nearest_points(divider1, divider2)
                 distance = nearest[0].distance(nearest[1])
@@ -18,63 +18,239 @@
 #
 #===============================================================================
 
-import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import sqlite3
+import time
 
 #===============================================================================
 
 import openpyxl
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 #===============================================================================
 
-ILX_ENDPOINT = 'http://uri.interlex.org/base/ilx_{:0>7}.json'
-VOCAB_ENDPOINT = 'https://scigraph.olympiangods.org/scigraph/vocabulary/id/{}.json'
+LABEL_ENDPOINTS = {
+    'interlex': 'http://uri.interlex.org/base',
+    'scigraph': 'https://scigraph.olympiangods.org/scigraph',
+}
+
+ILX_PATH = '/ilx_{:0>7}.json'
+VOCAB_PATH = '/vocabulary/id/{}.json'
+
+# Lookups are made concurrently, with failed requests retried
+
+MAX_LOOKUPS = 8
+LOOKUP_RETRIES = 3
+LOOKUP_TIMEOUT = 30     # seconds
+
+# Entities we couldn't find a label for aren't looked up again until
+# this long after their last attempt
+
+FAILED_LOOKUP_TTL = 24*60*60    # seconds
+
+# Labels most recently used are kept in memory and new ones are
+# written to the database in batches
+
+LABEL_CACHE_SIZE = 10000
+MAX_PENDING_WRITES = 500
+
+# How long to wait for another build to finish writing to the database
+
+DATABASE_TIMEOUT = 60           # seconds
+
+#===============================================================================
+
+def lookup_session(pool_size=MAX_LOOKUPS):
+#=========================================
+    retries = Retry(total=LOOKUP_RETRIES, backoff_factor=0.5,
+                    status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=len(LABEL_ENDPOINTS), pool_maxsize=pool_size,
+                          max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def lookup_label(session, endpoints, entity):
+#===========================================
+    """
+    Get an entity's label from InterLex or SciGraph, returning ``None`` if
+    the entity isn't known. Raises ``requests.RequestException`` or ``ValueError``
+    if the endpoint can't be accessed or its response isn't valid.
+    """
+    if entity.startswith('ILX:'):
+        url = endpoints['interlex'] + ILX_PATH.format(entity.strip().split(':')[-1])
+        response = session.get(url, timeout=LOOKUP_TIMEOUT)
+        if response:
+            for triple in response.json().get('triples', []):
+                if triple[1] == 'rdfs:label':
+                    return triple[2]
+    else:
+        url = endpoints['scigraph'] + VOCAB_PATH.format(entity)
+        response = session.get(url, timeout=LOOKUP_TIMEOUT)
+        if response:
+            labels = response.json().get('labels', [])
+            if labels:
+                return labels[0]
+    if response.status_code != requests.codes.not_found:
+        response.raise_for_status()
+    return None
 
 #===============================================================================
 
 class LabelData(object):
-    def __init__(self, database):
-        new_db = not os.path.exists(database)
-        self.__db = sqlite3.connect(database)
+    def __init__(self, database, endpoints=None, offline=False):
+        self.__db = sqlite3.connect(database, timeout=DATABASE_TIMEOUT)
+        # With write-ahead logging, builds sharing the database can read it
+        # while another is writing
+        self.__db.execute('PRAGMA journal_mode=WAL')
         self.__cursor = self.__db.cursor()
-        if new_db:
-            self.__cursor.execute('CREATE TABLE labels (entity text, label text)')
-            self.__db.commit()
+        self.__cursor.execute('CREATE TABLE IF NOT EXISTS labels (entity text, label text)')
+        self.__cursor.execute('CREATE INDEX IF NOT EXISTS labels_entity ON labels(entity)')
+        self.__cursor.execute('CREATE TABLE IF NOT EXISTS failed_lookups (entity text PRIMARY KEY, time real)')
+        self.__db.commit()
+        self.__cache = OrderedDict()
+        self.__pending_labels = {}
+        self.__pending_failures = {}
+        self.__endpoints = dict(LABEL_ENDPOINTS)
+        if endpoints is not None:
+            self.__endpoints.update({name: url.rstrip('/') for (name, url) in endpoints.items() if url})
+        self.__offline = offline
+        self.__session = None
+        # Entities whose label couldn't be found because we are offline
+        # or their lookup failed
+        self.__unresolved = set()
+        self.__unresolved_lookups = 0
+
+    @property
+    def unresolved_lookups(self):
+        return self.__unresolved_lookups
 
     def close(self):
+        self.flush()
+        if self.__session is not None:
+            self.__session.close()
         self.__db.close()
 
+    def flush(self):
+    #===============
+        # Write all new labels and failed lookups in a single transaction
+        if self.__pending_labels or self.__pending_failures:
+            with self.__db:
+                self.__db.executemany('REPLACE INTO labels(entity, label) VALUES (?, ?)',
+                                      self.__pending_labels.items())
+                self.__db.executemany('REPLACE INTO failed_lookups(entity, time) VALUES (?, ?)',
+                                      self.__pending_failures.items())
+            self.__pending_labels = {}
+            self.__pending_failures = {}
+
+    def __write_pending(self, pending, entity, value):
+        pending[entity] = value
+        if len(self.__pending_labels) + len(self.__pending_failures) >= MAX_PENDING_WRITES:
+            self.flush()
+
+    def __cache_label(self, entity, label):
+        self.__cache[entity] = label
+        self.__cache.move_to_end(entity)
+        if len(self.__cache) > LABEL_CACHE_SIZE:
+            self.__cache.popitem(last=False)
+
     def set_label(self, entity, label):
-        self.__cursor.execute('REPLACE INTO labels(entity, label) VALUES (?, ?)', (entity, label))
-        self.__db.commit()
+        self.__cache_label(entity, label)
+        self.__write_pending(self.__pending_labels, entity, label)
+
+    def __stored_label(self, entity):
+        label = self.__pending_labels.get(entity)
+        if label is None:
+            self.__cursor.execute('SELECT label FROM labels WHERE entity=?', (entity,))
+            row = self.__cursor.fetchone()
+            if row is not None:
+                label = row[0]
+        return label
+
+    def __recently_failed(self, entity):
+        failed_time = self.__pending_failures.get(entity)
+        if failed_time is None:
+            self.__cursor.execute('SELECT time FROM failed_lookups WHERE entity=?', (entity,))
+            row = self.__cursor.fetchone()
+            if row is None:
+                return False
+            failed_time = row[0]
+        return time.time() < failed_time + FAILED_LOOKUP_TTL
+
+    def __set_lookup_failed(self, entity):
+        self.__write_pending(self.__pending_failures, entity, time.time())
+
+    def __lookup(self, entity):
+        try:
+            label = lookup_label(self.__session, self.__endpoints, entity)
+        except (requests.RequestException, ValueError) as error:
+            return (entity, None, error)
+        return (entity, label, None)
+
+    def __save_lookup(self, entity, label, error):
+        if label is not None:
+            self.set_label(entity, label)
+            self.__unresolved.discard(entity)
+        elif error is None:
+            # The service doesn't know the entity
+            self.__set_lookup_failed(entity)
+        else:
+            # Not remembered, so the lookup is tried again next time
+            print("Couldn't get label for {}: {}".format(entity, error))
+            self.__unresolved.add(entity)
+
+    def __to_lookup(self, entities):
+        if self.__offline:
+            return []
+        return [entity for entity in entities
+                    if self.__stored_label(entity) is None
+                   and not self.__recently_failed(entity)]
+
+    def __open_session(self):
+        # Only connect when there is something to look up
+        if self.__session is None:
+            self.__session = lookup_session()
+
+    def prefetch(self, entities, max_lookups=MAX_LOOKUPS):
+    #=====================================================
+        """
+        Concurrently look up and save the labels of entities not already
+        in the database.
+        """
+        entities = self.__to_lookup(sorted(set(entities)))
+        if entities:
+            print('Looking up {} labels...'.format(len(entities)))
+            self.__open_session()
+            # Requests are made in worker threads but the database
+            # is only used from this one
+            with ThreadPoolExecutor(max_workers=max_lookups) as executor:
+                for result in executor.map(self.__lookup, entities):
+                    self.__save_lookup(*result)
+            self.flush()
 
     def get_label(self, entity):
-        self.__cursor.execute('SELECT label FROM labels WHERE entity=?', (entity,))
-        row = self.__cursor.fetchone()
-        if row is not None:
-            return row[0]
-        label = entity
-        if not entity.startswith('ILX:'):
-            try:
-                response = requests.get(VOCAB_ENDPOINT.format(entity))
-                if response:
-                    label = response.json().get('labels', [entity])[0]
-                    self.set_label(entity, label)
-            except:
-                print("Couldn't access", VOCAB_ENDPOINT.format(entity))
+        label = self.__cache.get(entity)
+        if label is not None:
+            self.__cache.move_to_end(entity)
         else:
-            endpoint = ILX_ENDPOINT.format(entity.strip().split(':')[-1])
-            try:
-                response = requests.get(endpoint)
-                if response:
-                    triples = response.json().get('triples')
-                    print(triples)
-                    for triple in triples:
-                        if triple[1] == 'rdfs:label':
-                            self.set_label(entity, triple[2])
-            except:
-                print("Couldn't access {} for {}".format(endpoint, entity))
+            label = self.__stored_label(entity)
+            if label is None:
+                label = entity
+                if self.__offline:
+                    self.__unresolved.add(entity)
+                elif not self.__recently_failed(entity):
+                    self.__open_session()
+                    result = self.__lookup(entity)
+                    self.__save_lookup(*result)
+                    if result[1] is not None:
+                        label = result[1]
+            self.__cache_label(entity, label)
+        if entity in self.__unresolved:
+            self.__unresolved_lookups += 1
         return label
 
 #===============================================================================
@@ -90,8 +266,8 @@ class AnatomicalMap(object):
         - If no ``Preferred ID`` is defined then the UBERON identifier is used.
         - The shape's label is set from its anatomical identifier; if none was assigned then the label is set to the shape's class.
     """
-    def __init__(self, label_database, mapping_spreadsheet=None):
-        self.__label_data = LabelData(label_database)
+    def __init__(self, label_database, mapping_spreadsheet=None, label_endpoints=None, offline=False):
+        self.__label_data = LabelData(label_database, label_endpoints, offline)
         self.__map = {}
         if mapping_spreadsheet is not None:
             for sheet in openpyxl.load_workbook(mapping_spreadsheet):
@@ -127,5 +303,21 @@ class AnatomicalMap(object):
             props['label'] = cls
         return props
 
+    def entity(self, cls):
+        return self.__map.get(cls)
+
+    @property
+    def unresolved_lookups(self):
+        return self.__label_data.unresolved_lookups
+
+    def close(self):
+        self.__label_data.close()
+
+    def flush_labels(self):
+        self.__label_data.flush()
+
     def label(self, entity):
         return self.__label_data.get_label(entity)
+
+    def prefetch_labels(self, entities):
+        self.__label_data.prefetch(entities)
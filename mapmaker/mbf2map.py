@@ -18,7 +18,6 @@
 #
 #===============================================================================
 
-import json
 import os
 from pathlib import Path
 
@@ -32,7 +31,8 @@ import shapely.geometry
 #===============================================================================
 
 from flatmap import Flatmap, MapLayer
-from geometry import mercator_transform, mercator_transformer, transform_point
+from geometry import coordinate_precision, geojson_geometry, round_values
+from geometry import mercator_transform_all, mercator_transformer, transform_point
 from tilemaker import make_background_tiles_from_image
 
 #===============================================================================
@@ -42,9 +42,10 @@ METRES_PER_UM = 100
 #===============================================================================
 
 class MBFLayer(MapLayer):
-    def __init__(self, xml_file, layer_id):
+    def __init__(self, xml_file, layer_id, coordinate_precision=None):
         super().__init__(layer_id)
         self.__xml_file = xml_file
+        self.__coordinate_precision = coordinate_precision
 
         self.__mbf = etree.parse(xml_file).getroot()
         self.__ns = self.__mbf.nsmap[None]
@@ -102,12 +103,9 @@ class MBFLayer(MapLayer):
 
     def geojson_features(self, tile_layer):
     #======================================
-        features = []
-        next_id = 1
+        contours = []
+        geometries = []
         for contour in self.__mbf.findall(self.ns_tag('contour')):
-            label = contour.get('name')
-            association = contour.xpath('ns:property[@name="TraceAssociation"]/ns:s', namespaces={'ns': self.__ns})
-            anatomical_id = association[0].text if len(association) else None
             points = []
             for point in contour.findall(self.ns_tag('point')):
                 x = float(point.get('x'))
@@ -117,10 +115,20 @@ class MBFLayer(MapLayer):
             if contour.get('closed'):
                 if points[0] != points[-1]:
                     points.append(points[-1])
-                geometry = shapely.geometry.Polygon((points))
+                geometries.append(shapely.geometry.Polygon((points)))
             else:
-                geometry = shapely.geometry.LineString(points)
-            mercator_geometry = mercator_transform(geometry)
+                geometries.append(shapely.geometry.LineString(points))
+            contours.append(contour)
+
+        # Project all of the layer's geometries together
+        mercator_geometries = mercator_transform_all(geometries)
+
+        features = []
+        next_id = 1
+        for (contour, geometry, mercator_geometry) in zip(contours, geometries, mercator_geometries):
+            label = contour.get('name')
+            association = contour.xpath('ns:property[@name="TraceAssociation"]/ns:s', namespaces={'ns': self.__ns})
+            anatomical_id = association[0].text if len(association) else None
 
             source_layer = '{}-{}'.format(self.layer_id, tile_layer)
             feature = {
@@ -129,12 +137,12 @@ class MBFLayer(MapLayer):
                 'tippecanoe' : {
                     'layer' : source_layer
                 },
-                'geometry': shapely.geometry.mapping(mercator_geometry),
+                'geometry': geojson_geometry(mercator_geometry, self.__coordinate_precision),
                 'properties': {
                     'area': geometry.area,
-                    'bounds': list(mercator_geometry.bounds),
+                    'bounds': round_values(mercator_geometry.bounds, self.__coordinate_precision),
                     # The viewer requires `centroid`
-                    'centroid': list(list(mercator_geometry.centroid.coords)[0]),
+                    'centroid': round_values(mercator_geometry.centroid.coords[0], self.__coordinate_precision),
                     'id': '{}#{}'.format(self.layer_id, next_id),
                     'length': geometry.length,
                     'layer': self.layer_id,
@@ -152,16 +160,11 @@ class MBFLayer(MapLayer):
 
         return features
 
-    def save(self, map_dir):
-    #=======================
-        tile_layer = 'features'
-        filename = os.path.join(map_dir, '{}_{}.json'.format(self.layer_id, tile_layer))
-        # Tippecanoe doesn't need a FeatureCollection
-        # Delimit features with RS...LF   (RS = 0x1E)
-        with open(filename, 'w') as output_file:
-            for feature in self.geojson_features(tile_layer):
-                output_file.write('\x1E{}\x0A'.format(json.dumps(feature)))
-        return {tile_layer: filename}
+    @property
+    def geojson_layers(self):
+        return {
+            'features': self.geojson_features('features')
+        }
 
 #===============================================================================
 
@@ -178,6 +181,11 @@ def main():
                         help='maximum zoom level (defaults to 10)')
     parser.add_argument('--min-zoom', dest='min_zoom', metavar='N', type=int, default=2,
                         help='minimum zoom level (defaults to 2)')
+    parser.add_argument('--coordinate-precision', metavar='DECIMALS', type=int,
+                        help='round feature coordinates to this many decimal places '
+                             '(defaults to what is needed at the maximum zoom level)')
+    parser.add_argument('--optimise-tiles', action='store_true',
+                        help='analyse and vacuum tile databases once they are written (may take a while...)')
     parser.add_argument('-u', '--upload', metavar='USER@SERVER',
                         help='Upload generated map to server')
 
@@ -197,6 +205,10 @@ def main():
         sys.exit('--max-zoom must be between {} and 15'.format(args.min_zoom))
     if args.initial_zoom < args.min_zoom or args.initial_zoom > args.max_zoom:
         sys.exit('--initial-zoom must be between {} and {}'.format(args.min_zoom, args.max_zoom))
+    if args.coordinate_precision is None:
+        args.coordinate_precision = coordinate_precision(args.max_zoom)
+    elif args.coordinate_precision < 0:
+        sys.exit('--coordinate-precision cannot be negative')
 
     map_zoom = (args.min_zoom, args.max_zoom, args.initial_zoom)
 
@@ -207,16 +219,16 @@ def main():
     if not os.path.exists(args.mbf_file):
         sys.exit('Missing MBF XML file')
 
-    mbf_layer = MBFLayer(os.path.abspath(args.mbf_file), 'vagus')
+    mbf_layer = MBFLayer(os.path.abspath(args.mbf_file), 'vagus', args.coordinate_precision)
     flatmap = Flatmap(args.map_id, args.mbf_file, ' '.join(sys.argv),
                       map_dir, map_zoom, mbf_layer.latlng_bounds())
     flatmap.add_layer(mbf_layer)
 
     print('Running tippecanoe...')
-    flatmap.make_vector_tiles()
+    flatmap.make_vector_tiles(args.optimise_tiles)
 
     print('Creating index and style files...')
-    flatmap.save_map_json(True)
+    flatmap.save_map_json(True, args.optimise_tiles)
 
     """
     Only if no os.path.isfile(os.path.join(map_dir, '{}.mbtiles'.format(args.map_id)))) ??
@@ -225,7 +237,8 @@ def main():
     """
     print('Generating background tiles (may take a while...)')
     image_tile_files = make_background_tiles_from_image(flatmap.bounds, map_zoom, map_dir,
-                                                        mbf_layer.image, args.mbf_file, args.map_id)
+                                                        mbf_layer.image, args.mbf_file, args.map_id,
+                                                        optimise=args.optimise_tiles)
     flatmap.add_upload_files(image_tile_files)
 
     if args.upload:
@@ -18,6 +18,8 @@
 #
 #===============================================================================
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import io
 import os
 
@@ -31,28 +33,66 @@ import mbutil as mb
 
 #===============================================================================
 
+# Tiles are inserted in transactions of this many tiles
+
+BATCH_SIZE = 1000
+
+# Number of threads for encoding PNG tiles when an MBTiles database is
+# being written to, and how many tiles per thread can wait to be encoded
+
+PNG_ENCODERS = 4
+ENCODER_QUEUE = 4
+
+#===============================================================================
+
 class ExtractionError(Exception):
     pass
 
 #===============================================================================
 
+def encode_png(image):
+#=====================
+    return cv2.imencode('.png', image)[1]
+
+#===============================================================================
+
 class MBTiles(object):
-    def __init__(self, filepath, create=False, force=False, silent=False):
+    def __init__(self, filepath, create=False, force=False, silent=False,
+                 journal_mode='DELETE', synchronous='OFF', encoders=0, batch_size=BATCH_SIZE):
         self._silent = silent
         if force and os.path.exists(filepath):
             os.remove(filepath)
         self._connnection = mb.mbtiles_connect(filepath, self._silent)
         self._cursor = self._connnection.cursor()
-        mb.optimize_connection(self._cursor)
+        self._cursor.execute('PRAGMA synchronous={}'.format(synchronous))
+        self._cursor.execute('PRAGMA locking_mode=EXCLUSIVE')
+        self._cursor.execute('PRAGMA journal_mode={}'.format(journal_mode)).fetchall()
         if create:
             mb.mbtiles_setup(self._cursor)
+        self._batch_size = batch_size
+        self._tiles = []
+        # PNG encoding releases the GIL so we encode using threads
+        self._encoders = encoders
+        self._encoder = ThreadPoolExecutor(encoders) if encoders > 0 else None
+        self._encoding = deque()
 
-    def close(self, compress=False):
+    def close(self, compress=False, optimise=False):
+        """
+        Write any outstanding tiles and close the database. Analysing and
+        vacuuming the database is optional as it can take a long time.
+        """
+        self.flush()
+        if self._encoder is not None:
+            self._encoder.shutdown()
+            self._encoder = None
         if compress:
             mb.compression_prepare(self._cursor, self._silent)
             mb.compression_do(self._cursor, self._connnection, 256, self._silent)
             mb.compression_finalize(self._cursor, self._connnection, self._silent)
-        mb.optimize_database(self._connnection, self._silent)
+        self._connnection.commit()
+        if optimise:
+            mb.optimize_database(self._connnection, self._silent)
+        self._connnection.close()
 
     def execute(self, sql):
         return self._cursor.execute(sql)
@@ -73,6 +113,7 @@ class MBTiles(object):
             return dict(self._connnection.execute('select name, value from metadata;').fetchall())
 
     def get_tile(self, zoom, x, y):
+        self.flush()
         rows = self._cursor.execute("""select tile_data from tiles
                                           where zoom_level=? and tile_column=? and tile_row=?;""",
                                                           (zoom,             x,             mb.flip_y(zoom, y)))
@@ -81,10 +122,33 @@ class MBTiles(object):
         return cv2.imdecode(np.frombuffer(data[0], 'B'), cv2.IMREAD_UNCHANGED)
 
     def save_tile_as_png(self, zoom, x, y, image):
-        output = cv2.imencode('.png', image)[1]
-        self._cursor.execute("""insert into tiles (zoom_level, tile_column, tile_row, tile_data)
-                                           values (?, ?, ?, ?);""",
-                                                  (zoom, x, mb.flip_y(zoom, y), sqlite3.Binary(output))
-                            )
+        if self._encoder is None:
+            self.save_tile_data(zoom, x, y, encode_png(image))
+        else:
+            # The image mustn't be changed until it has been encoded
+            self._encoding.append((zoom, x, y, self._encoder.submit(encode_png, image)))
+            while len(self._encoding) > ENCODER_QUEUE*self._encoders:
+                self.save_encoded_tile_()
+
+    def save_encoded_tile_(self):
+        (zoom, x, y, future) = self._encoding.popleft()
+        self.save_tile_data(zoom, x, y, future.result())
+
+    def save_tile_data(self, zoom, x, y, data):
+        self._tiles.append((zoom, x, mb.flip_y(zoom, y), sqlite3.Binary(data)))
+        if len(self._tiles) >= self._batch_size:
+            self.insert_tiles_()
+
+    def insert_tiles_(self):
+        if self._tiles:
+            self._cursor.executemany("""insert into tiles (zoom_level, tile_column, tile_row, tile_data)
+                                                   values (?, ?, ?, ?);""", self._tiles)
+            self._connnection.commit()
+            self._tiles = []
+
+    def flush(self):
+        while self._encoding:
+            self.save_encoded_tile_()
+        self.insert_tiles_()
 
 #===============================================================================
@@ -18,8 +18,25 @@
 #
 #===============================================================================
 
+from functools import lru_cache
+
+#===============================================================================
+
 from pyparsing import alphanums, nums, printables, Combine, delimitedList, Group, Keyword
-from pyparsing import Optional, ParseException, Suppress, Word, ZeroOrMore, ParseResults
+from pyparsing import Optional, ParseException, ParserElement, Suppress, Word, ZeroOrMore, ParseResults
+
+# Memoise partial parses; pyparsing 3 renamed ``enablePackrat()``
+
+if hasattr(ParserElement, 'enable_packrat'):
+    ParserElement.enable_packrat()
+else:
+    ParserElement.enablePackrat()
+
+#===============================================================================
+
+# Shapes often have the same markup, e.g. ``.boundary``
+
+MARKUP_CACHE_SIZE = 8192
 
 #===============================================================================
 
@@ -90,36 +107,47 @@ class Parser(object):
 
     FEATURE_PROPERTIES = CLASS | IDENTIFIER | STYLE
 
+    SHAPE_FLAG_NAMES = frozenset(['boundary', 'children', 'closed', 'interior'])
     SHAPE_FLAGS = Group(Keyword('boundary')
                       | Keyword('children')
                       | Keyword('closed')
                       | Keyword('interior')
                       )
 
+    DEPRECATED_FLAG_NAMES = frozenset(['siblings', 'marker'])
     DEPRECATED_FLAGS = Group(Keyword('siblings')
                            | Keyword('marker')
                            )
 
+    FEATURE_FLAG_NAMES = frozenset(['group', 'invisible', 'divider', 'region'])
     FEATURE_FLAGS = Group(Keyword('group')
                         | Keyword('invisible')
                         | Keyword('divider')
                         | Keyword('region')
                       )
 
+    IGNORED_PROPERTIES = DEPRECATED_FLAG_NAMES | SHAPE_FLAG_NAMES
+
     SHAPE_MARKUP = '.' + ZeroOrMore(DEPRECATED_FLAGS | FEATURE_FLAGS | FEATURE_PROPERTIES | PATH | SHAPE_FLAGS)
 
 #===============================================================================
 
     @staticmethod
     def shape_properties(name_text):
+        # Callers modify the properties so give them their own copy
+        return dict(Parser.parse_shape_markup_(name_text))
+
+    @staticmethod
+    @lru_cache(maxsize=MARKUP_CACHE_SIZE)
+    def parse_shape_markup_(name_text):
         properties = {}
         try:
             parsed = Parser.SHAPE_MARKUP.parseString(name_text, parseAll=True)
             for prop in parsed[1:]:
-                if (Parser.FEATURE_FLAGS.matches(prop[0])
-                 or Parser.SHAPE_FLAGS.matches(prop[0])):
+                if (prop[0] in Parser.FEATURE_FLAG_NAMES
+                 or prop[0] in Parser.SHAPE_FLAG_NAMES):
                     properties[prop[0]] = True
-                elif Parser.DEPRECATED_FLAGS.matches(prop[0]):
+                elif prop[0] in Parser.DEPRECATED_FLAG_NAMES:
                     properties['warning'] = "'{}' property is deprecated".format(prop[0])
                 elif prop[0] == 'id':
                     # Keep separate from feature's unique id
@@ -132,7 +160,7 @@ class Parser(object):
 
     @staticmethod
     def ignore_property(name):
-        return Parser.DEPRECATED_FLAGS.matches(name) or Parser.SHAPE_FLAGS.matches(name)
+        return name in Parser.IGNORED_PROPERTIES
 
 #===============================================================================
 
@@ -19,15 +19,16 @@
 #===============================================================================
 
 from collections import defaultdict
-import json
 import pyparsing
 
 #===============================================================================
 
 try:
     from parser import Parser
+    import serialise
 except ImportError:
     from mapmaker.parser import Parser
+    import mapmaker.serialise as serialise
 
 #===============================================================================
 
@@ -128,8 +129,6 @@ class Pathways(object):
         self.__routes_by_path_id = {}
         self.__nerves_by_path_id = {}
         self.__types_by_path_id = {}
-        self.__layer_paths = set()
-        self.__resolved_pathways = None
         for path in paths_list:
             path_id = path['id']
             self.__lines_by_path_id[path_id] = []
@@ -166,10 +165,6 @@ class Pathways(object):
     def __make_list(lst):
         return list(lst) if isinstance(lst, pyparsing.ParseResults) else [ lst ]
 
-    @property
-    def resolved_pathways(self):
-        return self.__resolved_pathways
-
     def properties(self, id):
         result = {}
         if id in self.__paths_by_line_id:
@@ -181,32 +176,27 @@ class Pathways(object):
                 result['type'] = 'line'
             result['path-id'] = path_id
             result['tile-layer'] = 'pathways'
-            self.__layer_paths.add(path_id)
         elif id in self.__paths_by_nerve_id:
             path_id = self.__paths_by_nerve_id[id][0]
             result['path-id'] = path_id
             result['tile-layer'] = 'pathways'
             result['type'] = 'nerve'
-            self.__layer_paths.add(path_id)
         return result
 
-    def set_feature_ids(self, id_map, class_map, class_count):
-        if self.__resolved_pathways is not None:
-            return
-        self.__resolved_pathways = ResolvedPathways(id_map, class_map, class_count)
+    def resolve_pathways(self, resolved_pathways, path_ids):
         errors = False
-        for path_id in self.__layer_paths:
+        for path_id in path_ids:
             try:
-                self.__resolved_pathways.add_pathway(path_id,
-                                                     self.__lines_by_path_id.get(path_id, []),
-                                                     self.__nerves_by_path_id.get(path_id, []),
-                                                     self.__routes_by_path_id.get(path_id, {
-                                                        'start-nodes': [],
-                                                        'through-nodes': [],
-                                                        'end-nodes': [],
-                                                     })
-                                                    )
-                self.__resolved_pathways.add_path_type(path_id, self.__types_by_path_id.get(path_id))
+                resolved_pathways.add_pathway(path_id,
+                                              self.__lines_by_path_id.get(path_id, []),
+                                              self.__nerves_by_path_id.get(path_id, []),
+                                              self.__routes_by_path_id.get(path_id, {
+                                                 'start-nodes': [],
+                                                 'through-nodes': [],
+                                                 'end-nodes': [],
+                                              })
+                                             )
+                resolved_pathways.add_path_type(path_id, self.__types_by_path_id.get(path_id))
             except ValueError as err:
                 print('Path {}: {}'.format(path_id, str(err)))
                 errors = True
@@ -215,6 +205,33 @@ class Pathways(object):
 
 #===============================================================================
 
+class LayerPathways(object):
+    """
+    The pathways used by a layer, from path definitions shared by all layers.
+    """
+    def __init__(self, pathways):
+        self.__pathways = pathways
+        self.__layer_paths = set()
+        self.__resolved_pathways = None
+
+    @property
+    def resolved_pathways(self):
+        return self.__resolved_pathways
+
+    def properties(self, id):
+        result = self.__pathways.properties(id)
+        if 'path-id' in result:
+            self.__layer_paths.add(result['path-id'])
+        return result
+
+    def set_feature_ids(self, id_map, class_map, class_count):
+        if self.__resolved_pathways is not None:
+            return
+        self.__resolved_pathways = ResolvedPathways(id_map, class_map, class_count)
+        self.__pathways.resolve_pathways(self.__resolved_pathways, self.__layer_paths)
+
+#===============================================================================
+
 def pathways_to_json(pathways_list):
     path_lines = {}
     path_nerves = {}
@@ -225,7 +242,7 @@ def pathways_to_json(pathways_list):
         path_nerves.update(resolved_pathways.path_nerves)
         node_paths.update(resolved_pathways.node_paths)
         type_paths.update(resolved_pathways.type_paths)
-    return json.dumps({
+    return serialise.dumps({
         'path-lines': path_lines,
         'path-nerves': path_nerves,
         'node-paths': node_paths.as_dict,
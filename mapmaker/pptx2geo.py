@@ -27,8 +27,12 @@ if __name__ == '__main__':
     import os
 
     parser = argparse.ArgumentParser(description='Extract geometries from Powerpoint slides.')
+    parser.add_argument('--coordinate-precision', metavar='DECIMALS', type=int,
+                        help='round feature coordinates to this many decimal places')
     parser.add_argument('--debug-xml', action='store_true',
                         help="save a slide's DrawML for debugging")
+    parser.add_argument('--flatten-tolerance', metavar='METRES', type=float,
+                        help='flatten curves so that they are no more than this distance from their outline')
     parser.add_argument('--format', choices=['geojson', 'svg'], default='geojson',
                         help='output format (default `geojson`)')
     parser.add_argument('--slide', type=int, metavar='N',
@@ -52,6 +56,6 @@ if __name__ == '__main__':
     elif args.format == 'svg':
         extractor = SvgExtractor(args.powerpoint, args)
 
-    extractor.slides_to_layers(args.slide)
+    list(extractor.slides_to_layers(args.slide, args.output_dir, debug_xml=args.debug_xml))
 
 #===============================================================================
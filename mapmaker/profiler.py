@@ -0,0 +1,152 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2020  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:     # Not available on Windows
+    resource = None
+
+#===============================================================================
+
+def children_cpu_time():
+#=======================
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def peak_rss_kb(children=False):
+#===============================
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children
+                         else resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return rss//1024 if sys.platform == 'darwin' else rss
+
+#===============================================================================
+
+class Timer(object):
+    """
+    Wall clock and CPU time, including that of finished child processes,
+    used by a block of code.
+    """
+    def __init__(self):
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+    #===============
+        self.__wall_start = time.perf_counter()
+        self.__cpu_start = time.process_time() + children_cpu_time()
+
+    def stop(self):
+    #==============
+        self.wall_time = time.perf_counter() - self.__wall_start
+        self.cpu_time = time.process_time() + children_cpu_time() - self.__cpu_start
+
+    def as_dict(self):
+        return {
+            'wall-time': self.wall_time,
+            'cpu-time': self.cpu_time
+        }
+
+#===============================================================================
+
+class Profiler(object):
+    def __init__(self):
+        self.__stages = OrderedDict()
+        self.__slides = []
+        self.__timer = Timer()
+        self.__timer.start()
+
+    def __add_time(self, name, wall_time, cpu_time):
+    #===============================================
+        stage = self.__stages.setdefault(name, {
+            'stage': name,
+            'wall-time': 0.0,
+            'cpu-time': 0.0,
+            'count': 0
+        })
+        stage['wall-time'] += wall_time
+        stage['cpu-time'] += cpu_time
+        stage['count'] += 1
+
+    @contextmanager
+    def stage(self, name):
+    #=====================
+        # Repeated stages are accumulated
+        with Timer() as timer:
+            yield
+        self.__add_time(name, timer.wall_time, timer.cpu_time)
+
+    def iterate(self, name, iterable):
+    #=================================
+        # Time getting each item of an iteration as a stage, not counting
+        # the final step that finds there are no more items
+        iterator = iter(iterable)
+        timer = Timer()
+        while True:
+            timer.start()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            timer.stop()
+            self.__add_time(name, timer.wall_time, timer.cpu_time)
+            yield item
+
+    def add_layer(self, layer):
+    #==========================
+        statistics = layer.statistics.copy()
+        statistics['layer'] = layer.layer_id
+        self.__slides.append(statistics)
+        if 'group-processing' in statistics:
+            self.__add_time('process-groups', statistics['group-processing']['wall-time'],
+                                              statistics['group-processing']['cpu-time'])
+
+    def save(self, filename, **details):
+    #===================================
+        self.__timer.stop()
+        report = OrderedDict(details)
+        report['total'] = self.__timer.as_dict()
+        report['peak-rss-kb'] = {
+            'self': peak_rss_kb(),
+            'children': peak_rss_kb(children=True)
+        }
+        report['stages'] = list(self.__stages.values())
+        report['slides'] = self.__slides
+        with open(filename, 'w') as output_file:
+            json.dump(report, output_file, indent=4)
+
+#===============================================================================
@@ -25,25 +25,28 @@ import json
 try:
     from labels import AnatomicalMap
     from parser import Parser
-    from pathways import Pathways
+    from pathways import LayerPathways, Pathways
 except ImportError:
     from mapmaker.labels import AnatomicalMap
     from mapmaker.parser import Parser
-    from mapmaker.pathways import Pathways
+    from mapmaker.pathways import LayerPathways, Pathways
 
 #===============================================================================
 
 class Properties(object):
+    """
+    External properties of shapes, from the anatomical map and the properties
+    file, loaded once and shared by all of a map's layers.
+    """
     def __init__(self, settings):
+        # Not every tool has settings for looking up labels
         self.__anatomical_map = AnatomicalMap(settings.label_database,
-                                              settings.anatomical_map)
+                                              settings.anatomical_map,
+                                              getattr(settings, 'label_endpoints', None),
+                                              getattr(settings, 'offline', False))
         self.__properties_by_class = {}
         self.__properties_by_id = {}
         self.__pathways = None
-        self.__parse_errors = []
-        self.__ids_by_external_id = {}    # id: unique_feature_id
-        self.__class_counts = {}          # class: count
-        self.__ids_by_class = {}          # class: unique_feature_id
         if settings.properties:
             with open(settings.properties) as fp:
                 properties_dict = json.loads(fp.read())
@@ -67,10 +70,27 @@ class Properties(object):
                 else:
                     self.__properties_by_id[id] = properties
 
+    @property
+    def anatomical_map(self):
+        return self.__anatomical_map
+
     @property
     def pathways(self):
         return self.__pathways
 
+    @property
+    def unresolved_lookups(self):
+        return self.__anatomical_map.unresolved_lookups
+
+    def close(self):
+    #===============
+        # Save any new labels
+        self.__anatomical_map.close()
+
+    def flush_labels(self):
+    #======================
+        self.__anatomical_map.flush_labels()
+
     def properties_from_class(self, cls):
     #====================================
         return self.__properties_by_class.get(cls, {})
@@ -79,6 +99,58 @@ class Properties(object):
     #================================
         return self.__properties_by_id.get(id, {})
 
+    def prefetch_labels(self, shapes):
+    #=================================
+        """
+        Look up the labels of all anatomical entities referenced by the
+        markup of ``shapes``, so that they aren't looked up one at a time
+        when the shapes' properties are found.
+        """
+        entities = set()
+        for shape in shapes:
+            if shape.name.startswith('.'):
+                properties = Parser.shape_properties(shape.name)
+                if 'class' in properties:
+                    cls = properties['class']
+                    entities.add(self.__anatomical_map.entity(cls))
+                    entities.add(self.properties_from_class(cls).get('models'))
+                if 'external-id' in properties:
+                    entities.add(self.properties_from_id(properties['external-id']).get('models'))
+                entities.add(properties.get('models'))
+        entities.discard(None)
+        self.__anatomical_map.prefetch_labels(entities)
+
+#===============================================================================
+
+class LayerProperties(object):
+    """
+    Find the properties of a layer's shapes, keeping track of the identifiers
+    and classes used in the layer so its pathways can be resolved.
+    """
+    def __init__(self, properties):
+        self.__properties = properties
+        self.__pathways = None
+        if properties.pathways is not None:
+            self.__pathways = LayerPathways(properties.pathways)
+        self.__parse_errors = []
+        self.__ids_by_external_id = {}    # id: unique_feature_id
+        self.__class_counts = {}          # class: count
+        self.__ids_by_class = {}          # class: unique_feature_id
+        self.__unresolved_lookups = properties.unresolved_lookups
+
+    @property
+    def pathways(self):
+        return self.__pathways
+
+    @property
+    def unresolved_labels(self):
+        # Has a label been looked up without success since the layer was started?
+        return self.__properties.unresolved_lookups > self.__unresolved_lookups
+
+    def flush_labels(self):
+    #======================
+        self.__properties.flush_labels()
+
     def set_class_id(self, class_id, feature_id):
     #============================================
         self.__ids_by_class[class_id] = feature_id
@@ -125,14 +197,14 @@ class Properties(object):
                         self.__class_counts[cls] = 1
                     self.__ids_by_class[cls] = None
 
-                    properties.update(self.__anatomical_map.properties(cls))
-                    properties.update(self.properties_from_class(cls))
+                    properties.update(self.__properties.anatomical_map.properties(cls))
+                    properties.update(self.__properties.properties_from_class(cls))
                     if self.__pathways is not None:
                         properties.update(self.__pathways.properties(cls))
 
                 if 'external-id' in properties:
                     id = properties['external-id']
-                    properties.update(self.properties_from_id(id))
+                    properties.update(self.__properties.properties_from_id(id))
                     if self.__pathways is not None:
                         properties.update(self.__pathways.properties(id))
 
@@ -146,7 +218,7 @@ class Properties(object):
                         properties['kind'] = 'simulation'
 
                 if 'models' in properties and 'label' not in properties:
-                    properties['label'] = self.__anatomical_map.label(properties['models'])
+                    properties['label'] = self.__properties.anatomical_map.label(properties['models'])
 
             return properties
         else:
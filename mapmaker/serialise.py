@@ -0,0 +1,61 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2020  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""Serialise features and metadata as JSON, using `orjson` when it is installed."""
+
+#===============================================================================
+
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#===============================================================================
+
+def default_(obj):
+#=================
+    # NumPy values the encoder doesn't know about
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+    #==============
+        return orjson.dumps(obj, default=default_, option=ORJSON_OPTIONS).decode('utf-8')
+
+else:
+    def dumps(obj):
+    #==============
+        return json.dumps(obj, default=default_)
+
+def dump(obj, fp):
+#=================
+    fp.write(dumps(obj))
+
+#===============================================================================
@@ -37,7 +37,7 @@ from tqdm import tqdm
 
 #===============================================================================
 
-from mbtiles import MBTiles, ExtractionError
+from mbtiles import MBTiles, PNG_ENCODERS
 
 #===============================================================================
 
@@ -47,17 +47,28 @@ MAX_ZOOM  = 10
 TILE_SIZE = (512, 512)
 WHITE     = (255, 255, 255)
 
+# With more than one job, a layer's tiles are made in chunks, each the
+# tiles of a subtree of the tile pyramid at most this many levels deep
+
+CHUNK_LEVELS = 4
+
+# PDF pages are rendered in blocks of up to this many tiles square, so long
+# as a block's image fits within the memory budget (in bytes)
+
+META_TILE_SIZE = 8
+META_TILE_MEMORY = 256*1024*1024
+
 #===============================================================================
 
 # Based on https://stackoverflow.com/a/54148416/2159023
 
 def make_transparent(img, colour=WHITE):
-    transparent = img.copy()
+    # The image's alpha channel is set in place
     if colour == WHITE:
-        transparent[:, :, 3] = (255*((transparent[:, :, :3] != 255).any(axis=2) * (transparent[:, :, 3] != 0))).astype(np.uint8)
+        img[:, :, 3] = (255*((img[:, :, :3] != 255).any(axis=2) * (img[:, :, 3] != 0))).astype(np.uint8)
     else:
-        transparent[:, :, 3] = (255*((transparent[:,:,0:3] != tuple(colour)[0:3]).any(axis=2) * (transparent[:, :, 3] != 0))).astype(np.uint8)
-    return transparent
+        img[:, :, 3] = (255*((img[:,:,0:3] != tuple(colour)[0:3]).any(axis=2) * (img[:, :, 3] != 0))).astype(np.uint8)
+    return img
 
 #===============================================================================
 
@@ -73,6 +84,20 @@ def transparent_image(size=(1, 1)):
 
 #===============================================================================
 
+def pixmap_image(pixmap):
+    # View the pixmap's samples as an array. ``samples`` returns a new copy
+    # of them each time it is used, so we use a memoryview when PyMuPDF has
+    # one. Samples have premultiplied alpha, which is removed as they are
+    # copied into the image, and then converted in place to the BGRA order
+    # used by OpenCV
+    buffer = pixmap.samples_mv if hasattr(pixmap, 'samples_mv') else pixmap.samples
+    samples = np.ndarray((pixmap.height, pixmap.width, pixmap.n), dtype=np.uint8,
+                         buffer=buffer, strides=(pixmap.stride, pixmap.n, 1))
+    image = cv2.cvtColor(samples, cv2.COLOR_mRGBA2RGBA)
+    return cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA, dst=image)
+
+#===============================================================================
+
 def get_image_size(img):
     return tuple(reversed(img.shape[:2]))
 
@@ -157,6 +182,10 @@ class TileSource(object):
     #=====================================
         return (TILE_SIZE[0]/(x1 - x0), TILE_SIZE[1]/(y1 - y0))
 
+    # Set by a subclass that can render a block of tiles more
+    # quickly than rendering the block's tiles one at a time
+    renders_blocks = False
+
     def get_tile(self, tile_x, tile_y):
     #==================================
         (x0, y0) = self._tile_to_image.transform(TILE_SIZE[0]*tile_x,
@@ -204,6 +233,8 @@ class ImageTileSource(TileSource):
 #===============================================================================
 
 class PDFTileSource(TileSource):
+    renders_blocks = True
+
     def __init__(self, image_rect, pdf_page):
         super().__init__(image_rect, pdf_page.rect)
         self._pdf_page = pdf_page
@@ -223,16 +254,94 @@ class PDFTileSource(TileSource):
         pixmap = self._pdf_page.getPixmap(clip=fitz.Rect(x0, y0, x1, y1),
                                           matrix=fitz.Matrix(*scaling),
                                           alpha=True)
-        data = pixmap.getImageData('png')
-        return cv2.imdecode(np.frombuffer(data, 'B'), cv2.IMREAD_UNCHANGED)
+        return pixmap_image(pixmap)
+
+    def get_tile_block(self, tile_x, tile_y, size):
+    #==============================================
+        """
+        Render ``size`` by ``size`` tiles of the page with a single call to
+        ``getPixmap``, as most of the time taken to render a tile is spent
+        interpreting the page's contents, whatever the clip.
+
+        Returns an image of the whole block, padded to be transparent where
+        the block extends past the page, or ``None`` if the block is
+        completely outside of the page.
+        """
+        (x0, y0) = self._tile_to_image.transform(TILE_SIZE[0]*tile_x,
+                                                 TILE_SIZE[1]*tile_y)
+        (x1, y1) = self._tile_to_image.transform(TILE_SIZE[0]*(tile_x + size),
+                                                 TILE_SIZE[1]*(tile_y + size))
+        clip = fitz.Rect(max(x0, self._source_rect.x0), max(y0, self._source_rect.y0),
+                         min(x1, self._source_rect.x1), min(y1, self._source_rect.y1))
+        if clip.x0 >= clip.x1 or clip.y0 >= clip.y1:
+            return None
+
+        # Tiles in a block are exactly a tile's width apart, so unlike single
+        # tiles, which are rendered 1px smaller, they meet without overlapping
+        scaling = TileSource.get_scaling(self, x0, y0, x1, y1)
+        scaling = (size*scaling[0], size*scaling[1])
+        pixmap = self._pdf_page.getPixmap(clip=clip,
+                                          matrix=fitz.Matrix(*scaling),
+                                          alpha=True)
+        image = pixmap_image(pixmap)
+
+        # The pixmap's origin is in device pixels, as is the block's
+        block = transparent_image((size*TILE_SIZE[1], size*TILE_SIZE[0]))
+        offset_x = pixmap.x - round(x0*scaling[0])
+        offset_y = pixmap.y - round(y0*scaling[1])
+        image = image[max(0, -offset_y):block.shape[0] - offset_y,
+                      max(0, -offset_x):block.shape[1] - offset_x]
+        return paste_image(block, image, (max(0, offset_x), max(0, offset_y)))
+
+#===============================================================================
+
+class EncodedTiles(object):
+    """
+    Collect PNG encoded tiles, and count the tiles made, for writing to
+    an MBTiles database by another process.
+    """
+    def __init__(self):
+        self.tiles = []
+        self.count = 0
+
+    def save_tile_as_png(self, zoom, x, y, image):
+        self.tiles.append((zoom, x, y, cv2.imencode('.png', image)[1].tobytes()))
+
+    def update(self, count):
+        self.count += count
+
+#===============================================================================
+
+# Each worker process makes chunks of a single layer's tiles
+
+_tile_maker = None
+_tile_source = None
+
+def init_tile_worker_(tile_maker, tile_source):
+#=============================================
+    global _tile_maker, _tile_source
+    _tile_maker = tile_maker
+    _tile_source = tile_source
+
+def make_tile_chunk_(root):
+#==========================
+    encoded_tiles = EncodedTiles()
+    (zoom, x, y) = root
+    tile = _tile_maker.make_tile_tree_(_tile_source, encoded_tiles, zoom, x, y, encoded_tiles)
+    return (tile, encoded_tiles.tiles, encoded_tiles.count)
 
 #===============================================================================
 
 class TileMaker(object):
-    def __init__(self, extent, map_dir, map_zoom=(MIN_ZOOM, MAX_ZOOM)):
+    def __init__(self, extent, map_dir, map_zoom=(MIN_ZOOM, MAX_ZOOM), jobs=1,
+                 meta_tile_size=META_TILE_SIZE, optimise=False):
         self._map_dir = map_dir
         self._min_zoom = map_zoom[0]
         self._max_zoom = map_zoom[1]
+        self._jobs = jobs
+        self._meta_tile_size = meta_tile_size
+        self._optimise = optimise
+        self._meta_zoom = self.meta_zoom()
 
         # We need a manager to share the list of database names between processes
         self._manager = multiprocessing.Manager()
@@ -272,57 +381,161 @@ class TileMaker(object):
     def database_names(self):
         return self._database_names
 
+    def tile_range(self, zoom):
+    #==========================
+        # Tiles at ``zoom`` covering the same area as the maximum zoom tiles
+        shift = self._max_zoom - zoom
+        return ((self._tile_start_coords[0] >> shift, self._tile_start_coords[1] >> shift),
+                (self._tile_end_coords[0] >> shift, self._tile_end_coords[1] >> shift))
+
+    def tile_count(self, zoom):
+    #==========================
+        (start, end) = self.tile_range(zoom)
+        return (end[0] - start[0] + 1)*(end[1] - start[1] + 1)
+
+    def child_tiles(self, zoom, x, y):
+    #=================================
+        # The tiles in range at the next zoom level that a tile is an overview of
+        (start, end) = self.tile_range(zoom + 1)
+        for i in range(2):
+            for j in range(2):
+                (child_x, child_y) = (2*x + i, 2*y + j)
+                if (start[0] <= child_x <= end[0]
+                and start[1] <= child_y <= end[1]):
+                    yield (i, j, child_x, child_y)
+
+    def root_tiles(self, root_zoom, zoom=None, x=None, y=None):
+    #==========================================================
+        # Tiles at ``root_zoom``, in the order they are reached when making tiles
+        if zoom is None:
+            (start, end) = self.tile_range(self._min_zoom)
+            for x in range(start[0], end[0] + 1):
+                for y in range(start[1], end[1] + 1):
+                    yield from self.root_tiles(root_zoom, self._min_zoom, x, y)
+        elif zoom == root_zoom:
+            yield (zoom, x, y)
+        else:
+            for (i, j, child_x, child_y) in self.child_tiles(zoom, x, y):
+                yield from self.root_tiles(root_zoom, zoom + 1, child_x, child_y)
+
+    def meta_zoom(self):
+    #===================
+        # Blocks of tiles are rendered for each tile at this zoom level, so
+        # a block's tiles are those at maximum zoom that are under the tile.
+        # A block's image must fit within the memory budget
+        size = self._meta_tile_size
+        while size > 1 and 4*(size*TILE_SIZE[0])*(size*TILE_SIZE[1]) > META_TILE_MEMORY:
+            size //= 2
+        return max(self._min_zoom, self._max_zoom - int(math.log2(size)))
+
+    def chunk_zoom(self):
+    #====================
+        # Chunks are subtrees rooted at this zoom level, which is lowered
+        # until there are enough chunks to keep all jobs busy. A chunk
+        # always contains whole blocks, so tiles don't depend on the
+        # number of jobs
+        zoom = max(self._min_zoom, self._max_zoom - CHUNK_LEVELS)
+        while zoom < self._meta_zoom and self.tile_count(zoom) < 2*self._jobs:
+            zoom += 1
+        return min(zoom, self._meta_zoom)
+
     def make_tiles(self, source_id, tile_source, layer_id):
     #======================================================
         database_name = '{}.mbtiles'.format(layer_id)
         self._database_names.append(database_name)
-        mbtiles = MBTiles(os.path.join(self._map_dir, database_name), True, True)
+        mbtiles = MBTiles(os.path.join(self._map_dir, database_name), True, True,
+                          encoders=PNG_ENCODERS)
         mbtiles.add_metadata(id=layer_id, source=source_id)
 
-        zoom = self._max_zoom
-        print('Tiling zoom level {} for {}'.format(zoom, layer_id))
-        progress_bar = tqdm(total=len(self._tiles),
+        print('Tiling zoom levels {} to {} for {}'.format(self._min_zoom, self._max_zoom, layer_id))
+        progress_bar = tqdm(total=sum(self.tile_count(zoom) for zoom in range(self._min_zoom, self._max_zoom + 1)),
             unit='tiles', ncols=40,
             bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}')
-        for tile in self._tiles:
-            image = tile_source.get_tile(tile.x - self._tile_start_coords[0],
-                                         tile.y - self._tile_start_coords[1])
-            if not_transparent(image):
-                mbtiles.save_tile_as_png(zoom, tile.x, tile.y, image)
-            progress_bar.update(1)
+        if self._jobs <= 1:
+            chunks = None
+            chunk_zoom = None
+        else:
+            # Chunks of tiles are made by a pool of workers and then written
+            # to the database by this process, in the order they are needed
+            # for making the overview tiles above them. Workers are forked
+            # so inherit the tile source, as with our layer processes
+            chunk_zoom = self.chunk_zoom()
+            chunk_roots = list(self.root_tiles(chunk_zoom))
+            pool = multiprocessing.Pool(min(self._jobs, len(chunk_roots)),
+                                        initializer=init_tile_worker_,
+                                        initargs=(self, tile_source))
+            chunks = pool.imap(make_tile_chunk_, chunk_roots)
+        try:
+            (start, end) = self.tile_range(self._min_zoom)
+            for x in range(start[0], end[0] + 1):
+                for y in range(start[1], end[1] + 1):
+                    self.make_tile_tree_(tile_source, mbtiles, self._min_zoom, x, y,
+                                         progress_bar, chunks, chunk_zoom)
+        finally:
+            if chunks is not None:
+                pool.close()
+                pool.join()
         progress_bar.close()
-
-        self.make_overview_tiles(mbtiles, layer_id, zoom, self._tile_start_coords, self._tile_end_coords)
-        mbtiles.close() #True)
-
-    def make_overview_tiles(self, mbtiles, layer_id, zoom, start_coords, end_coords):
-    #================================================================================
-        if zoom > self._min_zoom:
-            zoom -= 1
-            print('Tiling zoom level {} for {}'.format(zoom, layer_id))
+        mbtiles.close(optimise=self._optimise) #True)
+
+    def make_tile_tree_(self, tile_source, mbtiles, zoom, x, y,
+                        progress_bar=None, chunks=None, chunk_zoom=None, block=None):
+    #=============================================================================
+        """
+        Make a tile, first making the four tiles at the next zoom level that
+        it is an overview of. Tiles are made depth first, so only the decoded
+        images of the children of the overview tiles in progress are kept in
+        memory.
+
+        Tiles at ``chunk_zoom`` are instead taken, along with all the tiles
+        under them, from the next of ``chunks`` made by worker processes.
+
+        If the tile source can, the maximum zoom tiles under a tile at the
+        meta tile zoom level are rendered as a single ``block``, which is
+        then sliced into tiles.
+
+        Returns the tile's image, or ``None`` if the tile is transparent.
+        """
+        if zoom == chunk_zoom:
+            (tile, encoded_tiles, tile_count) = next(chunks)
+            for (tile_zoom, tile_x, tile_y, data) in encoded_tiles:
+                mbtiles.save_tile_data(tile_zoom, tile_x, tile_y, data)
+            if progress_bar is not None:
+                progress_bar.update(tile_count)
+            return tile
+        if zoom == self._max_zoom:
+            if block is None:
+                tile = tile_source.get_tile(x - self._tile_start_coords[0],
+                                            y - self._tile_start_coords[1])
+            else:
+                (image, block_x, block_y) = block
+                if image is None:
+                    tile = transparent_image(TILE_SIZE)
+                else:
+                    left = TILE_SIZE[0]*(x - block_x)
+                    top = TILE_SIZE[1]*(y - block_y)
+                    tile = make_transparent(image[top:top + TILE_SIZE[1], left:left + TILE_SIZE[0]])
+        else:
+            if zoom == self._meta_zoom and tile_source.renders_blocks:
+                size = 1 << (self._max_zoom - zoom)
+                (block_x, block_y) = (size*x, size*y)
+                image = tile_source.get_tile_block(block_x - self._tile_start_coords[0],
+                                                   block_y - self._tile_start_coords[1], size)
+                block = (image, block_x, block_y)
             HALF_SIZE = (TILE_SIZE[0]//2, TILE_SIZE[1]//2)
-            half_start = (start_coords[0]//2, start_coords[1]//2)
-            half_end = (end_coords[0]//2, end_coords[1]//2)
-            progress_bar = tqdm(total=(half_end[0]-half_start[0]+1)
-                                     *(half_end[1]-half_start[1]+1),
-                unit='tiles', ncols=40,
-                bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}')
-            for x in range(half_start[0], half_end[0] + 1):
-                for y in range(half_start[1], half_end[1] + 1):
-                    overview_tile = transparent_image(TILE_SIZE)
-                    for i in range(2):
-                        for j in range(2):
-                            try:
-                                tile = mbtiles.get_tile(zoom+1, 2*x+i, 2*y+j)
-                                half_tile = cv2.resize(tile, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
-                                paste_image(overview_tile, half_tile, (i*HALF_SIZE[0], j*HALF_SIZE[1]))
-                            except ExtractionError:
-                                pass
-                    if not_transparent(overview_tile):
-                        mbtiles.save_tile_as_png(zoom, x, y, overview_tile)
-                    progress_bar.update(1)
-            progress_bar.close()
-            self.make_overview_tiles(mbtiles, layer_id, zoom, half_start, half_end)
+            tile = transparent_image(TILE_SIZE)
+            for (i, j, child_x, child_y) in self.child_tiles(zoom, x, y):
+                child_tile = self.make_tile_tree_(tile_source, mbtiles, zoom + 1, child_x, child_y,
+                                                  progress_bar, chunks, chunk_zoom, block)
+                if child_tile is not None:
+                    half_tile = cv2.resize(child_tile, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+                    paste_image(tile, half_tile, (i*HALF_SIZE[0], j*HALF_SIZE[1]))
+        if progress_bar is not None:
+            progress_bar.update(1)
+        if not_transparent(tile):
+            mbtiles.save_tile_as_png(zoom, x, y, tile)
+            return tile
+        return None
 
     def wait_for_processes(self):
     #============================
@@ -357,21 +570,27 @@ class TileMaker(object):
 
 #===============================================================================
 
-def make_background_tiles_from_image(map_bounds, map_zoom, map_dir, image, source_name, layer_id):
-    tile_maker = TileMaker(map_bounds, map_dir, map_zoom)
+def make_background_tiles_from_image(map_bounds, map_zoom, map_dir, image, source_name, layer_id, jobs=1,
+                                     optimise=False):
+    tile_maker = TileMaker(map_bounds, map_dir, map_zoom, jobs, optimise=optimise)
     tile_maker.start_make_tiles_from_image(image, source_name, layer_id)
     tile_maker.wait_for_processes()
     return tile_maker.database_names
 
 #===============================================================================
 
-def make_background_tiles_from_pdf(map_bounds, map_zoom, map_dir, pdf_bytes, source_name, layer_ids, slide=0):
-    tile_maker = TileMaker(map_bounds, map_dir, map_zoom)
+def make_background_tiles_from_pdf(map_bounds, map_zoom, map_dir, pdf_bytes, source_name, layer_ids, slide=0, jobs=1,
+                                   meta_tile_size=META_TILE_SIZE, optimise=False):
+    tile_maker = TileMaker(map_bounds, map_dir, map_zoom, jobs, meta_tile_size, optimise)
     if slide > 0:   # There is just a single layer
         tile_maker.start_make_tiles_from_pdf(pdf_bytes, '{}#{}'.format(source_name, slide), slide, layer_ids[0])
     else:
         for n, layer_id in enumerate(layer_ids):
             tile_maker.start_make_tiles_from_pdf(pdf_bytes, '{}#{}'.format(source_name, n+1), n+1, layer_id)
+            if jobs > 1:
+                # Each layer uses a pool of ``jobs`` workers, so layers
+                # are made one at a time to keep within that many
+                tile_maker.wait_for_processes()
 
     tile_maker.wait_for_processes()
     return tile_maker.database_names
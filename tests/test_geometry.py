@@ -0,0 +1,93 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2020  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""Compare our Mercator projection with ``pyproj``'s."""
+
+#===============================================================================
+
+import math
+import os
+import sys
+import unittest
+
+#===============================================================================
+
+from shapely.geometry import LineString, Point, Polygon
+
+#===============================================================================
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mapmaker'))
+
+from geometry import MERCATOR_RADIUS, MERCATOR_TOLERANCE
+from geometry import mercator_transform, mercator_transform_all, mercator_transformer
+
+#===============================================================================
+
+# Half the width of the world in Web Mercator metres, which is at ±180°
+# longitude and ±85.0511° latitude
+
+MERCATOR_BOUND = math.pi*MERCATOR_RADIUS
+
+SAMPLE_POINTS = [
+    (0.0, 0.0),
+    (1234567.8, -7654321.1),
+    (-9876543.2, 3456789.0),
+    (0.5*MERCATOR_BOUND, 0.25*MERCATOR_BOUND),
+    # At and near the bounds
+    (MERCATOR_BOUND, MERCATOR_BOUND),
+    (-MERCATOR_BOUND, -MERCATOR_BOUND),
+    (MERCATOR_BOUND, -MERCATOR_BOUND),
+    (-MERCATOR_BOUND, 0.0),
+    (0.0, MERCATOR_BOUND),
+    (0.999999*MERCATOR_BOUND, -0.999999*MERCATOR_BOUND),
+    (-0.999999*MERCATOR_BOUND, 0.999999*MERCATOR_BOUND),
+]
+
+#===============================================================================
+
+class MercatorTest(unittest.TestCase):
+    def assertProjected(self, points, lnglats):
+        self.assertEqual(len(points), len(lnglats))
+        for (point, lnglat) in zip(points, lnglats):
+            expected = mercator_transformer.transform(*point)
+            self.assertAlmostEqual(lnglat[0], expected[0], delta=MERCATOR_TOLERANCE)
+            self.assertAlmostEqual(lnglat[1], expected[1], delta=MERCATOR_TOLERANCE)
+
+    def test_points(self):
+        geometries = mercator_transform_all([Point(point) for point in SAMPLE_POINTS])
+        self.assertProjected(SAMPLE_POINTS, [geometry.coords[0] for geometry in geometries])
+
+    def test_geometries(self):
+        line = LineString(SAMPLE_POINTS)
+        polygon = Polygon(SAMPLE_POINTS[4:8])
+        (projected_line, projected_polygon) = mercator_transform_all([line, polygon])
+        self.assertProjected(SAMPLE_POINTS, list(projected_line.coords))
+        self.assertProjected(list(polygon.exterior.coords), list(projected_polygon.exterior.coords))
+
+    def test_single_geometry(self):
+        projected = mercator_transform(LineString(SAMPLE_POINTS))
+        self.assertProjected(SAMPLE_POINTS, list(projected.coords))
+
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+#===============================================================================
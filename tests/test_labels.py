@@ -0,0 +1,191 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2020  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""Look up labels from stand-in InterLex and SciGraph services."""
+
+#===============================================================================
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+#===============================================================================
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mapmaker'))
+
+import labels
+from labels import LabelData
+
+#===============================================================================
+
+# Responses of the stand-in services, by request path
+
+RESPONSES = {
+    '/scigraph/vocabulary/id/UBERON:0000948.json': {'labels': ['heart']},
+    '/interlex/ilx_0738400.json': {'triples': [['ilx_0738400', 'rdfs:label', 'cardiac nerve']]},
+}
+
+class LabelService(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        response = RESPONSES.get(self.path)
+        if response is None:
+            self.send_error(404)
+        else:
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def unused_url():
+#================
+    # Nothing listens on a port we have just released
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return 'http://127.0.0.1:{}'.format(port)
+
+#===============================================================================
+
+class LabelLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), LabelService)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.endpoints = {
+            'interlex': base_url + '/interlex',
+            'scigraph': base_url + '/scigraph/',
+        }
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.work_dir.name, 'labels.sqlite')
+        # Don't wait for retries of connection errors
+        patcher = mock.patch.object(labels, 'LOOKUP_RETRIES', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.work_dir.cleanup()
+
+    def failed_lookups(self):
+        with sqlite3.connect(self.database) as db:
+            return [row[0] for row in db.execute('SELECT entity FROM failed_lookups')]
+
+    def test_lookup(self):
+        label_data = LabelData(self.database, self.endpoints)
+        self.assertEqual(label_data.get_label('UBERON:0000948'), 'heart')
+        self.assertEqual(label_data.get_label('ILX:0738400'), 'cardiac nerve')
+        label_data.close()
+        # Labels are saved and not looked up again
+        label_data = LabelData(self.database, self.endpoints)
+        self.assertEqual(label_data.get_label('UBERON:0000948'), 'heart')
+        label_data.close()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_prefetch(self):
+        label_data = LabelData(self.database, self.endpoints)
+        label_data.prefetch(['UBERON:0000948', 'ILX:0738400', 'UBERON:0000948', 'UBERON:9999999'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(label_data.get_label('ILX:0738400'), 'cardiac nerve')
+        self.assertEqual(label_data.get_label('UBERON:9999999'), 'UBERON:9999999')
+        label_data.close()
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_not_found(self):
+        label_data = LabelData(self.database, self.endpoints)
+        self.assertEqual(label_data.get_label('UBERON:9999999'), 'UBERON:9999999')
+        label_data.close()
+        self.assertEqual(self.failed_lookups(), ['UBERON:9999999'])
+        # Entities the service doesn't know aren't looked up again
+        label_data = LabelData(self.database, self.endpoints)
+        self.assertEqual(label_data.get_label('UBERON:9999999'), 'UBERON:9999999')
+        label_data.close()
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_connection_error(self):
+        label_data = LabelData(self.database, {'scigraph': unused_url()})
+        self.assertEqual(label_data.get_label('UBERON:0000948'), 'UBERON:0000948')
+        label_data.close()
+        self.assertEqual(self.failed_lookups(), [])
+        # The entity is looked up again once the service can be reached
+        label_data = LabelData(self.database, self.endpoints)
+        self.assertEqual(label_data.get_label('UBERON:0000948'), 'heart')
+        label_data.close()
+
+    def test_no_session_when_stored(self):
+        label_data = LabelData(self.database, self.endpoints)
+        label_data.prefetch(['UBERON:0000948'])
+        label_data.close()
+        # Nothing is left to fetch, so no connection is made
+        with mock.patch.object(labels, 'lookup_session') as lookup_session:
+            label_data = LabelData(self.database, self.endpoints)
+            label_data.prefetch(['UBERON:0000948'])
+            self.assertEqual(label_data.get_label('UBERON:0000948'), 'heart')
+            label_data.close()
+            label_data = LabelData(self.database, self.endpoints, offline=True)
+            self.assertEqual(label_data.get_label('ILX:0738400'), 'ILX:0738400')
+            label_data.close()
+            lookup_session.assert_not_called()
+
+    def test_offline(self):
+        label_data = LabelData(self.database, self.endpoints, offline=True)
+        self.assertEqual(label_data.get_label('UBERON:0000948'), 'UBERON:0000948')
+        label_data.close()
+        self.assertEqual(self.server.requests, [])
+
+    def test_unresolved_lookups(self):
+        label_data = LabelData(self.database, {'scigraph': unused_url()})
+        label_data.get_label('UBERON:0000948')
+        label_data.get_label('UBERON:0000948')
+        self.assertEqual(label_data.unresolved_lookups, 2)
+        label_data.close()
+        label_data = LabelData(self.database, self.endpoints)
+        label_data.get_label('UBERON:0000948')
+        label_data.get_label('UBERON:9999999')
+        self.assertEqual(label_data.unresolved_lookups, 0)
+        label_data.close()
+        # Only labels not already saved are unresolved when offline
+        label_data = LabelData(self.database, self.endpoints, offline=True)
+        label_data.get_label('UBERON:0000948')
+        self.assertEqual(label_data.unresolved_lookups, 0)
+        label_data.get_label('ILX:0738400')
+        self.assertEqual(label_data.unresolved_lookups, 1)
+        label_data.close()
+
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+#===============================================================================